@@ -1,7 +1,8 @@
 import uuid as uuid_pkg
+from enum import Enum
 from typing import Optional, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, conlist
 from vapi.application import (Command, GenerateTask, ImagePosition, Outcome,
                               Priority, TaskDeliverable, VariationTask)
 
@@ -16,6 +17,17 @@ class RequestNew(RequestBase):
     uuid: Optional[uuid_pkg.UUID] = Field(default_factory=uuid_pkg.uuid4)
 
 
+RequestNewBatch = conlist(RequestNew, min_items=1, max_items=1000)
+
+
+class ResponseNewBatchItem(BaseModel):
+    uuid: uuid_pkg.UUID
+    conflict: bool = False
+
+
+RequestStatusBatch = conlist(uuid_pkg.UUID, min_items=1, max_items=1000)
+
+
 class RequestVariation(RequestBase):
     position: ImagePosition
     uuid: uuid_pkg.UUID
@@ -29,3 +41,10 @@ class ResponseStatus(BaseModel):
     error: Optional[str] = None
     progress: Optional[int] = None
     deliverable: Optional[TaskDeliverable] = None
+    version: Optional[str] = None  # changes whenever any other field does
+
+
+class TileFormat(str, Enum):
+    png = "png"
+    jpeg = "jpeg"
+    webp = "webp"
@@ -1,16 +1,60 @@
+import asyncio
+import hashlib
+import mimetypes
+import re
+import time
 import uuid
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from dependency_injector.wiring import Provide, inject
-from fastapi import APIRouter, Depends, HTTPException, status
-from vapi.application import (Command, GenerateTask, IQueueService, Outcome,
-                              RouteLabel, Task, VariationTask)
+from fastapi import (APIRouter, Depends, Header, HTTPException, Path, Query,
+                     WebSocket, WebSocketDisconnect, status)
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from vapi.application import (Command, GenerateTask, IBlobStore, ImagePosition,
+                              IQueueService, Outcome, RouteLabel, Task,
+                              VariationTask)
 from vapi.application.foundation import NotInCollection
+from vapi.infrastructure import ImageVariants, TaskWatcher
 from vapi.wiring import Container
 
-from .dto import RequestNew, RequestVariation, ResponseStatus
+from .dto import (RequestNew, RequestNewBatch, RequestStatusBatch,
+                  RequestVariation, ResponseNewBatchItem, ResponseStatus,
+                  TileFormat)
 
 router = APIRouter()
 
+keepalive = 15  # seconds of silence after which streams send a heartbeat
+byte_range = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def _to_status(task: Task) -> ResponseStatus:
+    resp = ResponseStatus(**task.dict(exclude={"uuid", "discord_msg_id"}))
+    resp.version = hashlib.sha1(resp.json().encode()).hexdigest()[:16]
+    return resp
+
+
+async def _follow(
+    uid: uuid.UUID,
+    queue_service: IQueueService,
+    task_watcher: TaskWatcher,
+    since_version: Optional[str] = None,
+) -> AsyncIterator[Optional[ResponseStatus]]:
+    """current status, then every change till the task is done.
+    None means nothing has changed for keepalive seconds"""
+    async with task_watcher.watch(uid) as events:
+        resp = _to_status(await queue_service.get_task_by_id(uid, touch=True))
+        while True:
+            if resp.version != since_version:
+                since_version = resp.version
+                yield resp
+                if resp.status in (Outcome.Success, Outcome.Failure):
+                    return
+            try:
+                resp = _to_status(await asyncio.wait_for(events.get(), keepalive))
+            except asyncio.TimeoutError:
+                yield None
+
 
 @router.post(
     "/new",
@@ -22,14 +66,6 @@ async def make_set(
     request: RequestNew,
     queue_service: IQueueService = Depends(Provide[Container.queue_service]),
 ):
-    try:
-        await queue_service.get_task_by_id(request.uuid)
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="this UUID is already processing",
-        )
-    except NotInCollection:
-        pass
     route_label = RouteLabel(priority=request.priority, bot_pool=request.route_hint)
     task = Task(
         uuid=request.uuid,
@@ -38,11 +74,41 @@ async def make_set(
         status=Outcome.New,
         params=GenerateTask(prompt=request.prompt),
     )
-    await queue_service.put_task(task)
-    await queue_service.publish_task(task.uuid, route_label)
+    if not await queue_service.create_and_publish(task):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="this UUID is already processing",
+        )
     return task.uuid
 
 
+@router.post(
+    "/new/batch",
+    response_model=List[ResponseNewBatchItem],
+    status_code=status.HTTP_201_CREATED,
+)
+@inject
+async def make_sets(
+    request: RequestNewBatch,  # type: ignore
+    queue_service: IQueueService = Depends(Provide[Container.queue_service]),
+):
+    tasks = [
+        Task(
+            uuid=item.uuid,
+            route_label=RouteLabel(priority=item.priority, bot_pool=item.route_hint),
+            command=Command.New,
+            status=Outcome.New,
+            params=GenerateTask(prompt=item.prompt),
+        )
+        for item in request
+    ]
+    created = await queue_service.create_and_publish_many(tasks)
+    return [
+        ResponseNewBatchItem(uuid=task.uuid, conflict=not c)
+        for task, c in zip(tasks, created)
+    ]
+
+
 @router.post(
     "/variation",
     response_model=uuid.UUID,
@@ -59,6 +125,10 @@ async def make_variation(
     task.params = VariationTask(position=request.position)
     task.progress = 0
     task.route_label.priority = request.priority
+    # a variation is a new job, the parent's stamps would skew its timings
+    task.created_at = datetime.utcnow()
+    task.dequeued_at = task.sent_at = None
+    task.first_progress_at = task.completed_at = None
     if task.deliverable is not None:
         task.deliverable.url = None
     await queue_service.put_task(task)
@@ -74,11 +144,239 @@ async def make_variation(
 @inject
 async def get_status(
     uuid: uuid.UUID,
+    wait: float = Query(0, ge=0, le=60, description="seconds to wait for a change"),
+    since_version: Optional[str] = Query(
+        None, description="version the client has already seen"
+    ),
     queue_service: IQueueService = Depends(Provide[Container.queue_service]),
+    task_watcher: TaskWatcher = Depends(Provide[Container.task_watcher]),
 ):
+    deadline = time.monotonic() + wait
+    async with task_watcher.watch(uuid) as events:
+        try:
+            task = await queue_service.get_task_by_id(uuid, touch=True)
+        except NotInCollection as ex:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(ex))
+        resp = _to_status(task)
+        while since_version is not None and resp.version == since_version:
+            remains = deadline - time.monotonic()
+            if remains <= 0:
+                break
+            try:
+                resp = _to_status(await asyncio.wait_for(events.get(), remains))
+            except asyncio.TimeoutError:
+                break
+    return resp
+
+
+@router.get("/status/stream")
+@inject
+async def stream_status(
+    uuid: uuid.UUID,
+    queue_service: IQueueService = Depends(Provide[Container.queue_service]),
+    task_watcher: TaskWatcher = Depends(Provide[Container.task_watcher]),
+):
+    """server-sent events with the task status on every change"""
+    follow = _follow(uuid, queue_service, task_watcher)
     try:
-        task = await queue_service.get_task_by_id(uuid)
+        first = await follow.__anext__()
     except NotInCollection as ex:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(ex))
-    await queue_service.put_task(task)
-    return ResponseStatus(**task.dict(exclude={"uuid", "discord_msg_id"}))
+
+    async def events():
+        resp = first
+        while True:
+            if resp is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"id: {resp.version}\nevent: status\ndata: {resp.json()}\n\n"
+            try:
+                resp = await follow.__anext__()
+            except StopAsyncIteration:
+                return
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+@router.websocket("/status/ws")
+@inject
+async def ws_status(
+    websocket: WebSocket,
+    uuid: uuid.UUID,
+    queue_service: IQueueService = Depends(Provide[Container.queue_service]),
+    task_watcher: TaskWatcher = Depends(Provide[Container.task_watcher]),
+):
+    """the task status on every change"""
+    await websocket.accept()
+    try:
+        async for resp in _follow(uuid, queue_service, task_watcher):
+            if resp is not None:
+                await websocket.send_text(resp.json())
+    except NotInCollection as ex:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(ex))
+        return
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
+
+
+@router.post(
+    "/status/batch",
+    response_model=Dict[uuid.UUID, Optional[ResponseStatus]],
+    status_code=status.HTTP_200_OK,
+)
+@inject
+async def get_statuses(
+    request: RequestStatusBatch,  # type: ignore
+    queue_service: IQueueService = Depends(Provide[Container.queue_service]),
+):
+    tasks = await queue_service.get_tasks_by_ids(request)
+    return {
+        uid: None if task is None else _to_status(task) for uid, task in tasks.items()
+    }
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """None when the header is to be ignored (malformed or several ranges),
+    ValueError when it can't be satisfied"""
+    mo = byte_range.match(header.strip())
+    if mo is None or not any(mo.groups()):
+        return None
+    if not mo.group(1):  # suffix range, the last N bytes
+        if int(mo.group(2)) == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - int(mo.group(2)), 0), size - 1
+    start = int(mo.group(1))
+    if mo.group(2) and int(mo.group(2)) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    end = min(int(mo.group(2)), size - 1) if mo.group(2) else size - 1
+    return start, end
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison, as If-None-Match requires
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+async def _deliverable(uid: uuid.UUID, queue_service: IQueueService):
+    try:
+        task = await queue_service.get_task_by_id(uid)
+    except NotInCollection as ex:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(ex))
+    if task.status != Outcome.Success or task.deliverable is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="no image")
+    return task.deliverable
+
+
+async def _serve_blob(
+    key: str,
+    blob_store: IBlobStore,
+    range_header: Optional[str],
+    if_none_match: Optional[str],
+) -> Response:
+    try:
+        size = await blob_store.size(key)
+    except NotInCollection as ex:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(ex))
+
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=86400",
+    }
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    start, end = 0, size - 1
+    code = status.HTTP_200_OK
+    if range_header is not None:
+        try:
+            requested = _parse_range(range_header, size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        if requested is not None:
+            start, end = requested
+            code = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        blob_store.read(key, start, end),
+        status_code=code,
+        media_type=mimetypes.guess_type(key)[0],
+        headers=headers,
+    )
+
+
+@router.get("/image/{uuid}")
+@inject
+async def get_image(
+    uuid: uuid.UUID,
+    size: Optional[int] = Query(
+        None, description="thumbnail instead of the full image"
+    ),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    queue_service: IQueueService = Depends(Provide[Container.queue_service]),
+    blob_store: IBlobStore = Depends(Provide[Container.blob_store]),
+    image_variants: ImageVariants = Depends(Provide[Container.image_variants]),
+):
+    """the generated image, served from the local copy"""
+    if size is not None and size not in image_variants.sizes:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"size is one of {image_variants.sizes}",
+        )
+    deliverable = await _deliverable(uuid, queue_service)
+    if deliverable.key is None:
+        if deliverable.url is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="no image"
+            )
+        # not copied yet
+        return RedirectResponse(deliverable.url)
+    key = deliverable.key
+    if size is not None:
+        try:
+            key = await image_variants.thumbnail(key, size)
+        except NotInCollection as ex:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(ex))
+    return await _serve_blob(key, blob_store, range_header, if_none_match)
+
+
+@router.get("/image/{uuid}/{position}")
+@inject
+async def get_tile(
+    uuid: uuid.UUID,
+    position: int = Path(..., ge=1, le=4, description="1-4, see ImagePosition"),
+    format: Optional[TileFormat] = None,
+    quality: int = Query(90, ge=1, le=100, description="for jpeg and webp"),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    queue_service: IQueueService = Depends(Provide[Container.queue_service]),
+    blob_store: IBlobStore = Depends(Provide[Container.blob_store]),
+    image_variants: ImageVariants = Depends(Provide[Container.image_variants]),
+):
+    """one image of the grid, cropped locally instead of an upscale job"""
+    deliverable = await _deliverable(uuid, queue_service)
+    if deliverable.key is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="image is not stored yet"
+        )
+    try:
+        key = await image_variants.tile(
+            deliverable.key,
+            ImagePosition(position),
+            format.value if format else None,
+            quality,
+        )
+    except NotInCollection as ex:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(ex))
+    return await _serve_blob(key, blob_store, range_header, if_none_match)
@@ -4,6 +4,7 @@ from typing import List, Optional
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import make_asgi_app
 
 from vapi.api import endpoint as api
 from vapi.wiring import Container
@@ -58,6 +59,7 @@ def main(argv: Optional[List[str]]):
         allow_headers=["*"],
     )
     app.include_router(api.router)
+    app.mount("/metrics", make_asgi_app())
     uvicorn.run(app, host="0.0.0.0", port=8123)
 
 
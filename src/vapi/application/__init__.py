@@ -1,7 +1,8 @@
-from .domain.task import (GenerateTask, RouteLabel, Task, TaskDeliverable,
-                          VariationTask)
+from .domain.task import (DequeuedTask, GenerateTask, PoolStats, RouteLabel,
+                          Task, TaskDeliverable, VariationTask)
 from .foundation import (Command, ImagePosition, NotFound, NotInCollection,
                          Outcome, Priority)
+from .service.blob_store import IBlobStore
 from .service.captcha_service import ICaptchaService
 from .service.queue_service import IQueueService
 
@@ -19,4 +20,7 @@ __all__ = [
     "RouteLabel",
     "ICaptchaService",
     "NotFound",
+    "DequeuedTask",
+    "PoolStats",
+    "IBlobStore",
 ]
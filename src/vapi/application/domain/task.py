@@ -1,5 +1,6 @@
 import uuid as uuid_pkg
-from typing import Optional, Union
+from datetime import datetime
+from typing import Dict, List, Optional, Union
 
 from pydantic import BaseModel
 from pydantic.fields import Field
@@ -18,6 +19,7 @@ class VariationTask(BaseModel):
 class TaskDeliverable(BaseModel):
     url: Optional[str] = None
     filename: str
+    key: Optional[str] = None  # of the local copy in the blob store
 
 
 class RouteLabel(BaseModel):
@@ -36,3 +38,21 @@ class Task(BaseModel):
     progress: Optional[int] = None
     deliverable: Optional[TaskDeliverable] = None
     discord_msg_id: Optional[int] = None
+    # lifecycle, UTC
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    dequeued_at: Optional[datetime] = None
+    sent_at: Optional[datetime] = None
+    first_progress_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+
+class DequeuedTask(BaseModel):
+    task_id: uuid_pkg.UUID
+    route_label: RouteLabel
+    queue_lens: List[int]
+
+
+class PoolStats(BaseModel):
+    bot_pool: str
+    queue_len: Dict[Priority, int]
+    tickets: Dict[Priority, int]
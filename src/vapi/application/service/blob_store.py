@@ -0,0 +1,26 @@
+import abc
+from typing import AsyncIterator, Optional
+
+
+class IBlobStore(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    async def put_stream(self, chunks: AsyncIterator[bytes], suffix: str = "") -> str:
+        """stores the content and returns its content-addressed key"""
+
+    @abc.abstractmethod
+    async def put(self, key: str, data: bytes):
+        """stores content derived from other blobs under a caller-chosen key"""
+
+    @abc.abstractmethod
+    async def size(self, key: str) -> int:
+        pass
+
+    @abc.abstractmethod
+    def read(
+        self, key: str, start: int = 0, end: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """bytes start..end of the blob, end inclusive"""
+
+    @abc.abstractmethod
+    async def sweep(self):
+        """drop least recently used derived blobs over the size limit"""
@@ -6,3 +6,11 @@ class ICaptchaService(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     async def solve(self, img_url: str, labels: List[str]) -> str:
         pass
+
+    @abc.abstractmethod
+    async def solve_image(self, img: bytes, labels: List[str]) -> str:
+        pass
+
+    async def reject(self, img_url: str, labels: List[str]):
+        """the answer given to this challenge was wrong"""
+        pass
@@ -1,8 +1,9 @@
 import abc
-from typing import Optional
+from datetime import timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
 from uuid import UUID
 
-from ..domain.task import RouteLabel, Task
+from ..domain.task import DequeuedTask, PoolStats, RouteLabel, Task
 from ..foundation import Priority
 
 
@@ -12,7 +13,48 @@ class IQueueService(metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    async def get_task_by_id(self, uid: UUID) -> Task:
+    async def get_first_task_id(
+        self,
+        route_labels: List[RouteLabel],
+        bot_id: Optional[int] = None,
+        visibility: Optional[timedelta] = None,
+    ) -> Optional[DequeuedTask]:
+        """pop from the first non-empty queue, in the given order.
+        with visibility the task is leased to bot_id until released or reaped"""
+        pass
+
+    @abc.abstractmethod
+    async def wait_first_task_id(
+        self,
+        route_labels: List[RouteLabel],
+        timeout: float,
+        bot_id: Optional[int] = None,
+        visibility: Optional[timedelta] = None,
+    ) -> Optional[DequeuedTask]:
+        """same as get_first_task_id but blocks up to timeout seconds"""
+        pass
+
+    @abc.abstractmethod
+    async def release_task(self, uid: UUID, bot_pool: str, bot_id: int) -> bool:
+        """drop the lease unless it has passed to another bot, True if dropped"""
+        pass
+
+    @abc.abstractmethod
+    async def reap_tasks(
+        self, bot_pool: str, bot_id: Optional[int] = None
+    ) -> List[Task]:
+        """requeue New / fail Pending tasks of expired leases.
+        with bot_id also requeue its leased New tasks regardless of the deadline"""
+        pass
+
+    @abc.abstractmethod
+    async def get_task_by_id(self, uid: UUID, touch: bool = False) -> Task:
+        """with touch the task's ttl is prolonged"""
+        pass
+
+    @abc.abstractmethod
+    async def get_tasks_by_ids(self, uids: List[UUID]) -> Dict[UUID, Optional[Task]]:
+        """None for the tasks which weren't found"""
         pass
 
     @abc.abstractmethod
@@ -23,6 +65,28 @@ class IQueueService(metaclass=abc.ABCMeta):
     async def put_task(self, task: Task):
         pass
 
+    @abc.abstractmethod
+    def listen_task_events(
+        self, accept: Optional[Callable[[UUID], bool]] = None
+    ) -> AsyncIterator[Task]:
+        """tasks as they are stored by put_task, only those accept takes if given"""
+        pass
+
+    @abc.abstractmethod
+    async def create_and_publish(self, task: Task) -> bool:
+        """store and enqueue a new task, False if its uuid is already taken"""
+        pass
+
+    @abc.abstractmethod
+    async def create_and_publish_many(self, tasks: List[Task]) -> List[bool]:
+        """create_and_publish for every task in one round trip"""
+        pass
+
+    @abc.abstractmethod
+    async def update_task_fields(self, uid: UUID, **fields: Any) -> bool:
+        """overwrite only the given fields, False if there's no such task"""
+        pass
+
     @abc.abstractmethod
     async def publish_task(self, uid: UUID, route_label: RouteLabel):
         pass
@@ -50,3 +114,8 @@ class IQueueService(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     async def count_tickets(self, route_label: RouteLabel) -> int:
         pass
+
+    @abc.abstractmethod
+    async def get_pool_stats(self, bot_pool: str) -> PoolStats:
+        """queue lengths and ticket counts for every priority of the pool"""
+        pass
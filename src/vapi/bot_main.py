@@ -1,13 +1,16 @@
 import asyncio
 import csv
+from typing import Optional
 
+import aiohttp
 from dependency_injector.wiring import Provide, inject
 from loguru import logger
 from prometheus_client import start_http_server
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from vapi.application import ICaptchaService, IQueueService
+from vapi.application import IBlobStore, ICaptchaService, IQueueService
+from vapi.infrastructure import ImageVariants
 from vapi.infrastructure.service.discord_bot import Bot
 from vapi.settings import Settings
 from vapi.wiring import Container
@@ -22,11 +25,19 @@ class FileChangeHandler(FileSystemEventHandler):
         path: str,
         queue_service: IQueueService,
         captcha_srv: ICaptchaService,
+        progress_flush_interval: float = 5.0,
+        http_session: Optional[aiohttp.ClientSession] = None,
+        blob_store: Optional[IBlobStore] = None,
+        image_variants: Optional[ImageVariants] = None,
     ):
         self.loop = loop
         self._path = path
         self._queue = queue_service
         self._captcha_srv = captcha_srv
+        self._progress_flush_interval = progress_flush_interval
+        self._http_session = http_session
+        self._blob_store = blob_store
+        self._image_variants = image_variants
 
     def on_modified(self, event):
         print(event)
@@ -48,6 +59,7 @@ class FileChangeHandler(FileSystemEventHandler):
                     human_name=row["human_name"],
                     proxy=row.get("proxy"),
                     captcha_service=self._captcha_srv,
+                    progress_flush_interval=self._progress_flush_interval,
                 )
 
                 if container.bot_id in tasks:
@@ -58,7 +70,10 @@ class FileChangeHandler(FileSystemEventHandler):
                     del tasks[container.bot_id]
                 bot = Bot(
                     init_cont=container,
-                    queue_service=self._queue
+                    queue_service=self._queue,
+                    http_session=self._http_session,
+                    blob_store=self._blob_store,
+                    image_variants=self._image_variants,
                     # , loop=self.loop
                 )
                 logger.info("adding", human=bot.identity)
@@ -73,10 +88,23 @@ class FileChangeHandler(FileSystemEventHandler):
         self._some()
 
 
+async def sweep_blobs(blob_store: IBlobStore, interval: float):
+    # one process sweeps for everyone: the store is shared with the api
+    while True:
+        try:
+            await blob_store.sweep()
+        except Exception as ex:
+            logger.error(f"blob sweep failed {ex}", human="blob_store")
+        await asyncio.sleep(interval)
+
+
 @inject
 async def main(
     queue_service: IQueueService = Provide[Container.queue_service],
     captcha_srv: ICaptchaService = Provide[Container.captcha_service],
+    http_session: aiohttp.ClientSession = Provide[Container.http_session],
+    blob_store: IBlobStore = Provide[Container.blob_store],
+    image_variants: ImageVariants = Provide[Container.image_variants],
 ):
     settings = Settings()
 
@@ -85,11 +113,18 @@ async def main(
         path=settings.discord_identity_file,
         queue_service=queue_service,
         captcha_srv=captcha_srv,
+        progress_flush_interval=settings.progress_flush_interval,
+        http_session=http_session,
+        blob_store=blob_store,
+        image_variants=image_variants,
     )
     observer = Observer()
     observer.schedule(event_handler, settings.discord_identity_file, recursive=True)
     observer.start()
     event_handler._some()
+    sweeper = asyncio.create_task(
+        sweep_blobs(blob_store, settings.derived_sweep_interval)
+    )
     await asyncio.gather(*[v[1] for v in tasks.values()])
 
     try:
@@ -97,6 +132,7 @@ async def main(
             await asyncio.sleep(2)
             observer.join(1)
     finally:
+        sweeper.cancel()
         observer.stop()
         observer.join()
 
@@ -1,5 +1,21 @@
+from .service.captcha_cache import RedisCaptchaCache
 from .service.discord_bot import Bot
+from .service.file_blob_store import FileBlobStore
+from .service.hedged_captcha_service import HedgedCaptchaService
+from .service.image_variants import ImageVariants
+from .service.instrumented_queue_service import InstrumentedQueueService
 from .service.redis_queue_service import RedisQueueRepo
+from .service.task_watcher import TaskWatcher
 from .service.twocaptchas_service import TwoCaptchasService
 
-__all__ = ["Bot", "RedisQueueRepo", "TwoCaptchasService"]
+__all__ = [
+    "Bot",
+    "RedisQueueRepo",
+    "TwoCaptchasService",
+    "TaskWatcher",
+    "RedisCaptchaCache",
+    "HedgedCaptchaService",
+    "FileBlobStore",
+    "ImageVariants",
+    "InstrumentedQueueService",
+]
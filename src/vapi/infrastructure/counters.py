@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 REQ_BY_METHOD = Counter(
     "requests_total", "number of MJ bot request by method", ["bot", "method"]
@@ -31,3 +31,56 @@ SERVICE_ERRORS = Counter(
 SERVICE_USAGE = Counter(
     "service_usage", "3d-party service requests", ["service", "account", "measurement"]
 )
+
+MSG_CACHE_HIT = Counter(
+    "msg_cache_hit", "message id to task lookups served locally", ["bot"]
+)
+
+MSG_CACHE_MISS = Counter(
+    "msg_cache_miss", "message id to task lookups sent to redis", ["bot"]
+)
+
+RATE_LIMIT_WAIT = Counter(
+    "ratelimit_wait_seconds", "time spent waiting for discord rate limits", ["bot"]
+)
+
+RATE_LIMIT_QUEUED = Gauge(
+    "ratelimit_queued", "requests waiting for discord rate limits", ["bot"]
+)
+
+RATE_LIMITED = Counter(
+    "ratelimit_throttled", "429 responses from discord", ["bot", "scope"]
+)
+
+SERVICE_LATENCY = Histogram(
+    "service_latency_seconds",
+    "3d-party service latency",
+    ["service", "provider", "outcome"],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180),
+)
+
+TASK_PHASE = Histogram(
+    "task_phase_seconds",
+    "task lifecycle phases: queue_wait, send, first_progress, generation, total",
+    ["phase", "bot_pool", "priority", "mode"],
+    buckets=(1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1200, 1800),
+)
+
+QUEUE_SERVICE_CALLS = Counter(
+    "queue_service_calls", "queue service calls", ["method", "outcome"]
+)
+
+QUEUE_SERVICE_LATENCY = Histogram(
+    "queue_service_latency_seconds",
+    "queue service call latency",
+    ["method"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5, 30),
+)
+
+QUEUE_SERVICE_BYTES = Counter(
+    "queue_service_payload_bytes",
+    "encoded task bytes the queue repo sends to and receives from redis",
+    ["method", "direction"],
+)
+
+REDIS_POOL = Gauge("redis_pool_connections", "redis connection pool usage", ["state"])
@@ -0,0 +1,46 @@
+from typing import Any, List, Optional
+
+import aiohttp
+from vapi.application import ICaptchaService
+
+
+def new_http_session(limit: int = 100, **kwargs: Any) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=60, connect=10),
+        **kwargs,
+    )
+
+
+async def init_http_session():
+    session = new_http_session()
+    yield session
+    await session.close()
+
+
+class HttpCaptchaService(ICaptchaService):
+    """fetches the challenge image, providers implement solve_image only"""
+
+    def __init__(self, session: Optional[aiohttp.ClientSession] = None) -> None:
+        self._session = session
+
+    @staticmethod
+    async def _download(session: aiohttp.ClientSession, img_url: str) -> bytes:
+        async with session.get(img_url) as resp:
+            return await resp.read()
+
+    async def _fetch(self, img_url: str) -> bytes:
+        if self._session is not None:
+            return await self._download(self._session, img_url)
+        async with new_http_session() as session:
+            return await self._download(session, img_url)
+
+    async def solve(self, img_url: str, labels: List[str]) -> str:
+        return await self.solve_image(await self._fetch(img_url), labels)
@@ -1,6 +1,8 @@
 import redis.asyncio as redis
 from redis import Redis
 
+from .counters import REDIS_POOL
+
 
 class RedisVolatileRepo:
     def __init__(self, redis: Redis) -> None:
@@ -9,4 +11,11 @@ class RedisVolatileRepo:
 
 async def init_redis_pool(redis_dsn: str):
     redis_conn = redis.from_url(redis_dsn, encoding="utf-8", decode_responses=True)
+    pool = redis_conn.connection_pool
+    REDIS_POOL.labels("in_use").set_function(lambda: len(pool._in_use_connections))
+    REDIS_POOL.labels("available").set_function(
+        lambda: len(pool._available_connections)
+    )
+    REDIS_POOL.labels("created").set_function(lambda: pool._created_connections)
+    REDIS_POOL.labels("max").set_function(lambda: pool.max_connections)
     yield redis_conn
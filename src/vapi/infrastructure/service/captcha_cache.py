@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+from datetime import timedelta
+from io import BytesIO
+from typing import List, Optional
+
+import aiohttp
+from redis import Redis
+from vapi.application import ICaptchaService
+from vapi.utils import dhash
+
+from ..counters import SERVICE_USAGE
+from ..http_base import HttpCaptchaService
+from ..redis_base import RedisVolatileRepo
+
+
+class RedisCaptchaCache(RedisVolatileRepo, HttpCaptchaService):
+    """remembers solutions by perceptual hash of the image and the label set.
+    many bots get the same challenge at once, so a repeat is no sign of a wrong
+    answer: a solution is dropped only when the bot reports it rejected"""
+
+    prefix = "captcha"
+
+    def __init__(
+        self,
+        redis: Redis,
+        captcha_service: ICaptchaService,
+        session: Optional[aiohttp.ClientSession] = None,
+        ttl: timedelta = timedelta(days=1),
+    ) -> None:
+        RedisVolatileRepo.__init__(self, redis)
+        HttpCaptchaService.__init__(self, session)
+        self._captcha_service = captcha_service
+        self._ttl = ttl
+
+    def _count(self, measurement: str):
+        SERVICE_USAGE.labels(
+            service=self.__class__.__name__, account="", measurement=measurement
+        ).inc()
+
+    async def _key(self, img: bytes, labels: List[str]) -> str:
+        phash = await asyncio.get_running_loop().run_in_executor(
+            None, dhash, BytesIO(img)
+        )
+        labels_hash = hashlib.sha1("\n".join(sorted(labels)).encode()).hexdigest()
+        return f"{self.prefix}_{phash:016x}_{labels_hash[:12]}"
+
+    async def solve_image(self, img: bytes, labels: List[str]) -> str:
+        key = await self._key(img, labels)
+        label = await self._redis.get(key)
+        if label is not None and label in labels:
+            self._count("cache_hit")
+            return label
+        self._count("cache_miss")
+        label = await self._captcha_service.solve_image(img, labels)
+        await self._redis.set(key, label, ex=int(self._ttl.total_seconds()))
+        return label
+
+    async def reject(self, img_url: str, labels: List[str]):
+        await self.reject_image(await self._fetch(img_url), labels)
+
+    async def reject_image(self, img: bytes, labels: List[str]):
+        if await self._redis.delete(await self._key(img, labels)):
+            self._count("cache_invalidated")
@@ -1,11 +1,12 @@
 import asyncio
 import itertools
+import os
 import random
 import re
 import sys
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Any, Dict, Optional
+from typing import Any, Coroutine, Dict, List, Optional, Set, Tuple
 from uuid import UUID
 
 import aiohttp
@@ -15,9 +16,15 @@ from discord import Client
 from discord.message import Message
 from loguru import logger
 from pydantic import BaseModel
-from vapi.application import (Command, IQueueService, NotInCollection, Outcome,
+from vapi.application import (Command, IBlobStore, IQueueService, Outcome,
                               Priority, RouteLabel, TaskDeliverable)
 from vapi.application.domain.task import GenerateTask, VariationTask
+from vapi.infrastructure.http_base import new_http_session
+from vapi.infrastructure.service.image_variants import ImageVariants
+from vapi.infrastructure.service.msg_task_cache import MsgTaskCache
+from vapi.infrastructure.service.progress_coalescer import ProgressCoalescer
+from vapi.infrastructure.service.prompt_index import PromptIndex
+from vapi.infrastructure.service.rate_limiter import DiscordRateLimiter
 
 logger.remove()
 fmt = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> {extra[human]} - <level>{message}</level>"
@@ -68,6 +75,7 @@ class Bot(Client):
         user_access_token: str
         proxy: Optional[str] = None
         captcha_service: Any
+        progress_flush_interval: float = 5.0
 
         def __hash__(self) -> int:
             return hash(
@@ -79,11 +87,12 @@ class Bot(Client):
     capacity = {True: 10, False: 1}
     progress_str = re.compile(r"\(([0-9]+)%\)")
     mode_str = re.compile(r"\(([a-z]+), ([a-z]+)\)")
-    clean_str = re.compile(r"[^A-Za-z]")
-    re_url = re.compile(r"http(s)?://[^\s]+")
-    percent_re = r"\d+%"
     max_evictions = 5
     min_fast_hours = 15 * 60  # 20 minutes
+    dequeue_timeout = 5  # seconds to block on empty queues
+    reap_interval = 60  # seconds between expired lease sweeps
+    # another challenge this soon after an answer means the answer was wrong
+    captcha_retry_window = timedelta(minutes=5)
     _info: Optional["Bot.Info"] = None
 
     def __init__(
@@ -91,6 +100,9 @@ class Bot(Client):
         *,
         init_cont: BotInitCont,
         queue_service: IQueueService,
+        http_session: Optional[aiohttp.ClientSession] = None,
+        blob_store: Optional[IBlobStore] = None,
+        image_variants: Optional[ImageVariants] = None,
         **options: Any,
     ) -> None:
         super().__init__(**options)
@@ -107,6 +119,12 @@ class Bot(Client):
             self._proxy = "{2}:{3}@{0}:{1}".format(*self._proxy.split(":"))
 
         self._queue_service = queue_service
+        self._msg_tasks = MsgTaskCache(queue_service, self._human_name)
+        self._prompts = PromptIndex()
+        self._rate_limiter = DiscordRateLimiter(self._human_name)
+        self._progress = ProgressCoalescer(
+            queue_service, init_cont.progress_flush_interval
+        )
         self._current_tasks: Dict[UUID, datetime] = {}
         self._logger = logger.bind(human=self._human_name)
         self._logger.debug(self._proxy)
@@ -117,6 +135,14 @@ class Bot(Client):
         )
         self._loop = None
         self.app_commands_data: dict = {}
+        # per-bot session for discord calls, the shared one for everything else
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._shared_session = http_session
+        self._blob_store = blob_store
+        self._image_variants = image_variants
+        self._background_tasks: Set["asyncio.Task[None]"] = set()
+        # when, image url and labels of this bot's last captcha answer
+        self._captcha_answered: Optional[Tuple[datetime, str, List[str]]] = None
 
     @property
     def identity(self) -> str:
@@ -125,13 +151,12 @@ class Bot(Client):
     async def get_data_from_midjourney(self) -> dict:
         url = f"https://discord.com/api/v9/channels/{self._channel_id}/application-commands/search?type=1&limit=25&include_applications=true"
         headers = {"Authorization": self._user_access_token}
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(url) as response:
-                try:
-                    raw_data = await response.json()
-                    return raw_data.get("application_commands")
-                except:
-                    pass
+        async with self._session.get(url, headers=headers) as response:
+            try:
+                raw_data = await response.json()
+                return raw_data.get("application_commands")
+            except:
+                pass
 
     @staticmethod
     def extract_initial_values(data_list: list, description: str) -> dict:
@@ -150,12 +175,11 @@ class Bot(Client):
             and len(self._current_tasks) > 0
         ):
             return
-        rl = RouteLabel(priority=Priority.High, bot_pool=self._bot_pool)
-        high_len = await self._queue_service.get_queue_len(rl)
-        high_tickets = await self._queue_service.count_tickets(rl)
-        rl = RouteLabel(priority=Priority.Normal, bot_pool=self._bot_pool)
-        normal_len = await self._queue_service.get_queue_len(rl)
-        normal_tickets = await self._queue_service.count_tickets(rl)
+        stats = await self._queue_service.get_pool_stats(self._bot_pool)
+        high_len = stats.queue_len[Priority.High]
+        high_tickets = stats.tickets[Priority.High]
+        normal_len = stats.queue_len[Priority.Normal]
+        normal_tickets = stats.tickets[Priority.Normal]
         if self._high_priority:
             # if need to help Normal queue
             if (
@@ -184,7 +208,20 @@ class Bot(Client):
             await self.send_info_cmd()
         if self._loop is None:
             raise ValueError("loop is None")
-        self._loop.create_task(self._recheck_info())
+        self._background(self._recheck_info())
+
+    def _route_labels(self) -> List[RouteLabel]:
+        return [
+            RouteLabel(priority=p, bot_id=bot, bot_pool=self._bot_pool)
+            for p, bot in itertools.product(Priority, (self._bot_id, None))
+            if not (
+                bot is None  # don't skip dedicated tasks
+                and self._high_priority
+                and p in (Priority.Low, Priority.Normal)
+                # ) or (
+                #     not self._high_priority and p in (Priority.VIP, Priority.High)
+            )
+        ]
 
     async def _worker(self):
         self._logger.info(f"Bot id {self._bot_id} worker starting")
@@ -197,11 +234,14 @@ class Bot(Client):
 
         await self.send_info_cmd()
         self._loop = asyncio.get_running_loop()
-        self._loop.create_task(self._recheck_info())
+        self._background(self._recheck_info())
+        waited = False
         while True:
             try:
                 task_id = None
-                await asyncio.sleep(1)
+                if not waited:
+                    await asyncio.sleep(1)
+                waited = False
                 while self._offline:
                     await asyncio.sleep(60)
 
@@ -217,17 +257,12 @@ class Bot(Client):
                     self.max_task_age = timedelta(minutes=30)
                     self._eviction_count += 1
                     self._logger.warning(ev)
+                # their leases expire as well and the reaper fails them
                 for t in ev:
+                    self._prompts.discard(t)
                     cnt.REQ_ERROR.labels(
                         self._human_name, "generic", "TaskEviction"
                     ).inc()
-                    try:
-                        t = await self._queue_service.get_task_by_id(t)
-                    except NotInCollection:
-                        # already expired
-                        break
-                    t.status = Outcome.Failure
-                    await self._queue_service.put_task(t)
                 self._current_tasks = {
                     k: v
                     for k, v in self._current_tasks.items()
@@ -266,34 +301,29 @@ class Bot(Client):
                 if self._info and self._info.queue > 0:
                     continue
 
-                for p, bot in itertools.product(Priority, (self._bot_id, None)):
-                    if (
-                        bot is None  # don't skip dedicated tasks
-                        and self._high_priority
-                        and p in (Priority.Low, Priority.Normal)
-                        # ) or (
-                        #     not self._high_priority and p in (Priority.VIP, Priority.High)
-                    ):
-                        continue
-                    route_label = RouteLabel(
-                        priority=p, bot_id=bot, bot_pool=self._bot_pool
-                    )
-                    task_id = await self._queue_service.get_next_task_id(route_label)
-                    if task_id is not None:
-                        self._logger.debug(f"{task_id} from {route_label}")
-                        break
-                else:
-                    cnt.IDLE.labels(self._human_name).inc()
+                dequeued = await self._queue_service.wait_first_task_id(
+                    self._route_labels(),
+                    self.dequeue_timeout,
+                    bot_id=self._bot_id,
+                    visibility=self.max_task_age,
+                )
+                waited = True
+                if dequeued is None:
+                    cnt.IDLE.labels(self._human_name).inc(self.dequeue_timeout)
                     continue
+                task_id = dequeued.task_id
+                self._logger.debug(f"{task_id} from {dequeued.route_label}")
 
                 task = await self._queue_service.get_task_by_id(task_id)
                 if task.status != Outcome.New:
+                    await self._release_task(task_id)
                     raise ValueError(f"task {task_id} has non New status {task.status}")
                 if task_id in self._current_tasks:
                     self._logger.warning(
                         f"Collision {task} is in {self._current_tasks}"
                     )
                 self._current_tasks[task_id] = datetime.utcnow()
+                self._progress.begin(task_id)
                 self._logger.debug(
                     f"{task_id},{list(self._current_tasks.keys())}, {task.params}"
                 )
@@ -303,26 +333,34 @@ class Bot(Client):
                     if task.command == Command.New and isinstance(
                         task.params, GenerateTask
                     ):
+                        self._prompts.add(task.uuid, task.params.prompt)
                         await self.send_prompt(task.params.prompt)
-                        task.status = Outcome.Pending
+                        # on_message may have written the task meanwhile
                         task.route_label.bot_id = self._bot_id
-                        await self._queue_service.put_task(task)
+                        await self._queue_service.update_task_fields(
+                            task.uuid,
+                            status=Outcome.Pending,
+                            route_label=task.route_label,
+                            dequeued_at=self._current_tasks[task_id],
+                            sent_at=datetime.utcnow(),
+                        )
                     elif task.command == Command.Variation and isinstance(
                         task.params, VariationTask
                     ):
-                        task = await self._queue_service.get_task_by_id(task.uuid)
                         if task.discord_msg_id is None or task.deliverable is None:
-                            task.status = Outcome.Failure
-                            await self._queue_service.put_task(task)
                             raise ValueError(f"invalid message flow {task}")
                         await self.request_variations(
                             task.params.position.value,
                             dscrd_msg_id=task.discord_msg_id,
                             dscrd_img_nm=task.deliverable.filename,
                         )
-                        task.status == Outcome.Pending
-                        task.progress = 0
-                        await self._queue_service.put_task(task)
+                        await self._queue_service.update_task_fields(
+                            task.uuid,
+                            status=Outcome.Pending,
+                            progress=0,
+                            dequeued_at=self._current_tasks[task_id],
+                            sent_at=datetime.utcnow(),
+                        )
                 except Exception as ex:
                     cnt.REQ_ERROR.labels(
                         self._human_name, task.command.value, str(type(ex))
@@ -330,17 +368,20 @@ class Bot(Client):
                     self._logger.error(f"{ex} {task}")
                     if task.command == Command.New:
                         task.route_label.bot_id = None
-                        task.status = Outcome.New
-                        await self._queue_service.put_task(task)
-                        await self._queue_service.push_back_task_id(
-                            str(task.uuid), task.route_label
+                        await self._queue_service.update_task_fields(
+                            task.uuid, status=Outcome.New, route_label=task.route_label
                         )
                     else:
                         # if variations fails on the origin bot - no other options
-                        task.status = Outcome.Failure
-                        await self._queue_service.put_task(task)
-                    if task_id is not None and task_id in self._current_tasks:
-                        del self._current_tasks[task_id]
+                        await self._queue_service.update_task_fields(
+                            task.uuid, status=Outcome.Failure
+                        )
+                    # the lease goes first: once pushed back another bot may own it
+                    await self._release_task(task_id)
+                    if task.command == Command.New:
+                        await self._queue_service.push_back_task_id(
+                            str(task.uuid), task.route_label
+                        )
                     self._logger.debug(self._current_tasks)
                     await asyncio.sleep(30)
                     raise
@@ -349,10 +390,81 @@ class Bot(Client):
                 cnt.REQ_ERROR.labels(self._human_name, "generic", str(type(ex))).inc()
         await self.close()
 
+    def _background(self, coro: Coroutine[Any, Any, None]):
+        t = asyncio.create_task(coro)
+        self._background_tasks.add(t)
+        t.add_done_callback(self._background_tasks.discard)
+
+    async def _store_deliverable(self, uid: UUID, deliverable: TaskDeliverable):
+        """keeps a local copy of the result, CDN links expire"""
+        try:
+            async with self._session.get(deliverable.url) as resp:
+                resp.raise_for_status()
+                deliverable.key = await self._blob_store.put_stream(
+                    resp.content.iter_chunked(64 * 1024),
+                    os.path.splitext(deliverable.filename)[1],
+                )
+            await self._queue_service.update_task_fields(uid, deliverable=deliverable)
+            if self._image_variants is not None:
+                await self._image_variants.thumbnails(deliverable.key)
+        except Exception as ex:
+            self._logger.error(f"{uid} deliverable was not stored {ex}")
+
+    async def _observe_lifecycle(self, uid: UUID, mode: Mode):
+        try:
+            task = await self._queue_service.get_task_by_id(uid)
+        except Exception as ex:
+            self._logger.error(f"{uid} {ex}")
+            return
+        stamps = [
+            ("queue_wait", task.created_at, task.dequeued_at),
+            ("send", task.dequeued_at, task.sent_at),
+            ("first_progress", task.sent_at, task.first_progress_at),
+            ("generation", task.sent_at, task.completed_at),
+            ("total", task.created_at, task.completed_at),
+        ]
+        labels = (task.route_label.bot_pool, task.route_label.priority.value, mode.name)
+        for phase, start, end in stamps:
+            if start is None or end is None:
+                continue
+            seconds = (end - start).total_seconds()
+            # stamps from another run of the task, or a skewed clock
+            if seconds >= 0:
+                cnt.TASK_PHASE.labels(phase, *labels).observe(seconds)
+
+    async def _release_task(self, uid: UUID):
+        if uid in self._current_tasks:
+            del self._current_tasks[uid]
+        self._prompts.discard(uid)
+        self._progress.forget(uid)
+        await self._queue_service.release_task(uid, self._bot_pool, self._bot_id)
+
+    async def _reaper(self):
+        # the first sweep also resumes tasks leased but not sent before a restart
+        bot_id: Optional[int] = self._bot_id
+        while True:
+            try:
+                for task in await self._queue_service.reap_tasks(
+                    self._bot_pool, bot_id
+                ):
+                    self._logger.warning(f"reaped {task.uuid} {task.status}")
+                    cnt.REQ_ERROR.labels(
+                        self._human_name, "generic", "TaskReaped"
+                    ).inc()
+            except Exception as ex:
+                self._logger.error(ex)
+            bot_id = None
+            await asyncio.sleep(self.reap_interval)
+
     async def start(self):
         t = None
-        self.app_commands_data = await self.get_data_from_midjourney()
+        r = None
+        p = None
+        self._session = new_http_session(limit=self.capacity[True])
         try:
+            self.app_commands_data = await self.get_data_from_midjourney()
+            r = asyncio.create_task(self._reaper())
+            p = asyncio.create_task(self._progress.run())
             t = asyncio.create_task(self._worker())
             self._logger.info(f"Bot id {self._bot_id} discord coroutine starting")
             await super().start(self._user_access_token)
@@ -360,26 +472,24 @@ class Bot(Client):
             cnt.BOT_STATE.labels(self._human_name, self._bot_pool).set(
                 Mode.Offline.value
             )
-            if t is not None:
-                t.cancel()
             self._logger.warning("cancelled")
             return
         except Exception as ex:
             self._logger.error(ex)
+        finally:
+            # nothing may outlive the session or keep reaping for a dead bot
+            for t_ in (t, r, p, *self._background_tasks):
+                if t_ is not None:
+                    t_.cancel()
+            await self._session.close()
 
     def str_in_str(self, substr: str, string: str) -> bool:
-        return self.clean_str.sub(
-            "",
-            re.split(self.percent_re, self.re_url.sub("", substr))[0].split("--")[0],
-        ) in self.clean_str.sub(
-            "",
-            re.split(self.percent_re, self.re_url.sub("", string))[0].split("--")[0],
-        )
+        return PromptIndex.normalize(substr) in PromptIndex.normalize(string)
 
     async def _ensure_task(self, message: Message):
         # result of new generation?
         try:
-            task_id = await self._queue_service.lookup_task_by_msg(message.id)
+            task_id = await self._msg_tasks.lookup(message.id)
             task = await self._queue_service.get_task_by_id(task_id)
             if (
                 task.command == Command.New
@@ -387,18 +497,19 @@ class Bot(Client):
                 and task.params.prompt
                 and task.params.prompt != message.content
             ):
-                task.params.prompt = message.content
-                await self._queue_service.put_task(task)
+                await self._queue_service.update_task_fields(
+                    task.uuid, params=GenerateTask(prompt=message.content)
+                )
+                if task.uuid in self._prompts:
+                    self._prompts.add(task.uuid, message.content)
             return
         except:
             pass
         # variations?
         if message.reference is not None and message.reference.message_id is not None:
             try:
-                task_id = await self._queue_service.lookup_task_by_msg(
-                    message.reference.message_id
-                )
-                await self._queue_service.map_msg2task(message.id, task_id)
+                task_id = await self._msg_tasks.lookup(message.reference.message_id)
+                await self._msg_tasks.map(message.id, task_id)
                 task = await self._queue_service.get_task_by_id(task_id)
                 if (
                     task.command == Command.New
@@ -406,37 +517,24 @@ class Bot(Client):
                     and task.params.prompt
                     and task.params.prompt != message.content
                 ):
-                    task.params.prompt = message.content
-                    await self._queue_service.put_task(task)
+                    await self._queue_service.update_task_fields(
+                        task.uuid, params=GenerateTask(prompt=message.content)
+                    )
+                    if task.uuid in self._prompts:
+                        self._prompts.add(task.uuid, message.content)
                 return
             except:
                 pass
         # new generation - 1st message
-        t__ = [
-            await self._queue_service.get_task_by_id(t)
-            for t in self._current_tasks.keys()
-        ]
-        t_ = [
-            t
-            for t in t__
-            if t.command == Command.New
-            and isinstance(t.params, GenerateTask)
-            and (
-                self.str_in_str(t.params.prompt, message.content)
-                or (
-                    len(message.embeds) > 0
-                    and message.embeds[0].footer.text
-                    and self.str_in_str(t.params.prompt, message.embeds[0].footer.text)
-                )
-            )
-        ]
-        if len(t_) > 1:
-            t_ = sorted(t_, key=lambda i: len(i.params.prompt))
-        if not t_:
+        uid = self._prompts.match(
+            message.content,
+            message.embeds[0].footer.text if len(message.embeds) > 0 else None,
+        )
+        if uid is None:
             self._logger.error(f"task for {message.content} was not found")
-            self._logger.info(t__)
+            self._logger.info(list(self._current_tasks.keys()))
             return
-        await self._queue_service.map_msg2task(message.id, t_[0].uuid)
+        await self._msg_tasks.map(message.id, uid)
 
     async def on_message(self, message: Message):
         if message.channel.id != self._channel_id:
@@ -451,7 +549,7 @@ class Bot(Client):
 
             await self._ensure_task(message)
             try:
-                uid = await self._queue_service.lookup_task_by_msg(message.id)
+                uid = await self._msg_tasks.lookup(message.id)
             except:
                 try:
                     if (
@@ -459,9 +557,7 @@ class Bot(Client):
                         and message.reference.message_id is not None
                     ):
 
-                        uid = await self._queue_service.lookup_task_by_msg(
-                            message.reference.message_id
-                        )
+                        uid = await self._msg_tasks.lookup(message.reference.message_id)
                     else:
                         cnt.REQ_ERROR.labels(
                             self._human_name, "generic", "TaskNotFound"
@@ -486,29 +582,31 @@ class Bot(Client):
                     if task.command == Command.New:
                         self._logger.debug(f"push back {uid}")
                         task.route_label.bot_id = None
-                        task.status = Outcome.New
-                        await self._queue_service.put_task(task)
+                        await self._queue_service.update_task_fields(
+                            uid, status=Outcome.New, route_label=task.route_label
+                        )
+                    else:
+                        await self._queue_service.update_task_fields(
+                            uid, status=Outcome.Failure, error="bot banned"
+                        )
+                    # the lease goes first: once pushed back another bot may own it
+                    await self._release_task(uid)
+                    if task.command == Command.New:
                         await self._queue_service.push_back_task_id(
                             str(task.uuid), task.route_label
                         )
-                    else:
-                        task.status = Outcome.Failure
-                        task.error = "bot banned"
-                        await self._queue_service.put_task(task)
-
-                    if uid is not None and uid in self._current_tasks:
-                        del self._current_tasks[uid]
                     await asyncio.sleep(10)
                     return
                 elif outc == DispatchOutcome.Abort:
                     return
 
             if "Waiting to start" in message.content:
-                task = await self._queue_service.get_task_by_id(uid)
-                task.status = Outcome.Pending
-                task.progress = 0
-                task.discord_msg_id = message.id
-                await self._queue_service.put_task(task)
+                await self._progress.write(
+                    uid,
+                    status=Outcome.Pending,
+                    progress=0,
+                    discord_msg_id=message.id,
+                )
             elif (
                 "Open on website" in message.content
                 or len(message.attachments)
@@ -517,20 +615,29 @@ class Bot(Client):
                 cnt.BOT_STATE.labels(self._human_name, self._bot_pool).set(
                     Mode.Fast.value if self._high_priority else Mode.Relaxed.value
                 )
-                task = await self._queue_service.get_task_by_id(uid)
-                task.status = Outcome.Success
-                task.progress = 100
-                task.deliverable = TaskDeliverable(
+                self._logger.debug(
+                    f"{uid}, {message.attachments[0].url} {message.attachments[0].filename}"
+                )
+                deliverable = TaskDeliverable(
                     url=message.attachments[0].url,
                     filename=message.attachments[0].filename,
                 )
-                task.discord_msg_id = message.id
-                self._logger.debug(
-                    f"{uid}, {message.attachments[0].url} {message.attachments[0].filename}"
+                await self._progress.write(
+                    uid,
+                    status=Outcome.Success,
+                    progress=100,
+                    deliverable=deliverable,
+                    discord_msg_id=message.id,
+                    completed_at=datetime.utcnow(),
                 )
-                await self._queue_service.put_task(task)
-                if uid in self._current_tasks:
-                    del self._current_tasks[uid]
+                self._background(
+                    self._observe_lifecycle(
+                        uid, Mode.Fast if self._high_priority else Mode.Relaxed
+                    )
+                )
+                if self._blob_store is not None:
+                    self._background(self._store_deliverable(uid, deliverable))
+                await self._release_task(uid)
                 cnt.SUCCEED.labels(self._human_name).inc()
                 self._logger.info(len(self._current_tasks))
             self._eviction_count = 0
@@ -570,10 +677,22 @@ class Bot(Client):
             "text": text,
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                if response.status > 299:
-                    self._logger.error("failed to notify")
+        session = self._shared_session or self._session
+        async with session.post(url, json=payload) as response:
+            if response.status > 299:
+                self._logger.error("failed to notify")
+
+    async def _reject_captcha(self):
+        if self._captcha_answered is None:
+            return
+        answered_at, img_url, labels = self._captcha_answered
+        self._captcha_answered = None
+        if datetime.utcnow() - answered_at > self.captcha_retry_window:
+            return
+        try:
+            await self._captcha_src.reject(img_url, labels)
+        except Exception as ex:
+            self._logger.error(f"captcha reject failed {ex}")
 
     async def _delayed_awake(self, delay: float):
         await asyncio.sleep(delay)
@@ -585,6 +704,7 @@ class Bot(Client):
         """dispatch and tell if needs retry at another worker"""
         if embed.description:
             if "human" in embed.description:
+                await self._reject_captcha()
                 for _ in range(2):
                     try:
                         labels = {
@@ -594,6 +714,11 @@ class Bot(Client):
                             embed.image.url, list(labels.keys())
                         )
                         await self._press_btn(msg.id, labels[label], flags=64)
+                        self._captcha_answered = (
+                            datetime.utcnow(),
+                            embed.image.url,
+                            list(labels.keys()),
+                        )
                         break
                     except aiohttp.ClientConnectorError:
                         continue
@@ -672,26 +797,26 @@ class Bot(Client):
 
         await self._ensure_task(msg)
         try:
-            uid = await self._queue_service.lookup_task_by_msg(msg.id)
+            uid = await self._msg_tasks.lookup(msg.id)
         except:
             try:
                 if msg.reference is not None and msg.reference.message_id is not None:
 
-                    uid = await self._queue_service.lookup_task_by_msg(
-                        msg.reference.message_id
-                    )
+                    uid = await self._msg_tasks.lookup(msg.reference.message_id)
                 else:
                     return DispatchOutcome.Abort
             except:
                 self._logger.error(f"uid for {msg.content} was not found")
                 return DispatchOutcome.Abort
-        task = await self._queue_service.get_task_by_id(uid)
-        task.status = Outcome.Failure
-        task.progress = 0
-        task.error = embed.description
-        self._logger.debug(task)
-        await self._queue_service.put_task(task)
-        del self._current_tasks[uid]
+        self._logger.debug(f"{uid} {embed.description}")
+        await self._progress.write(
+            uid,
+            status=Outcome.Failure,
+            progress=0,
+            error=embed.description,
+            completed_at=datetime.utcnow(),
+        )
+        await self._release_task(uid)
         self._logger.info(len(self._current_tasks))
         return DispatchOutcome.Abort
 
@@ -764,7 +889,7 @@ class Bot(Client):
         await self._ensure_task(after)
         if after.content.endswith("(Stopped)"):
             try:
-                uid = await self._queue_service.lookup_task_by_msg(after.id)
+                uid = await self._msg_tasks.lookup(after.id)
             except:
                 try:
                     if (
@@ -772,22 +897,20 @@ class Bot(Client):
                         and after.reference.message_id is not None
                     ):
 
-                        uid = await self._queue_service.lookup_task_by_msg(
-                            after.reference.message_id
-                        )
+                        uid = await self._msg_tasks.lookup(after.reference.message_id)
                     else:
                         return
                 except:
                     self._logger.error(f"uid for {after.content} was not found")
                     return
-            task = await self._queue_service.get_task_by_id(uid)
-            task.status = Outcome.Failure
-            await self._queue_service.put_task(task)
-            del self._current_tasks[uid]
+            await self._progress.write(
+                uid, status=Outcome.Failure, completed_at=datetime.utcnow()
+            )
+            await self._release_task(uid)
             self._logger.info(len(self._current_tasks))
         if "%" in after.content:
             try:
-                uid = await self._queue_service.lookup_task_by_msg(after.id)
+                uid = await self._msg_tasks.lookup(after.id)
             except:
                 try:
                     if (
@@ -795,18 +918,14 @@ class Bot(Client):
                         and after.reference.message_id is not None
                     ):
 
-                        uid = await self._queue_service.lookup_task_by_msg(
-                            after.reference.message_id
-                        )
+                        uid = await self._msg_tasks.lookup(after.reference.message_id)
                     else:
                         return
                 except:
                     self._logger.error(f"uid for {after.content} was not found")
                     return
-            task = await self._queue_service.get_task_by_id(uid)
             if mo := self.progress_str.search(after.content):
-                task.progress = int(mo.group(1))
-                await self._queue_service.put_task(task)
+                self._progress.push(uid, int(mo.group(1)))
             if mo := self.mode_str.search(after.content):
                 if self._high_priority and mo.group(1) != "fast":
                     cnt.REQ_ERROR.labels(
@@ -816,30 +935,32 @@ class Bot(Client):
 
     async def _send_req(self, payload: dict) -> str:
         header = {"authorization": self._user_access_token}
-        async with aiohttp.ClientSession(headers=header) as session:
-            kwargs = {}
-            if self._proxy:
-                kwargs["proxy"] = "http://" + self._proxy
-            for trial in range(3):
-                async with session.post(
-                    self.url,
-                    json=payload,
-                    **kwargs,
-                ) as response:
-                    if response.status > 299:
-                        self._logger.error(f"{self._bot_id}: {response}")
-                        text = await response.text()
-                        txt = f"Unexpected response {response.status} {text}"
-
-                        if response.status == 400:
-                            raise BadRequest(txt)
-                        elif response.status == 429:
-                            await asyncio.sleep(5 * trial + 1)
-                            continue
-                        elif response.status == 401:
-                            raise NotAuthorized(txt)
-                        raise GenericRequestError(txt)
-                    return await response.text()
+        kwargs = {}
+        if self._proxy:
+            kwargs["proxy"] = "http://" + self._proxy
+        for _ in range(3):
+            await self._rate_limiter.acquire(self.url)
+            async with self._session.post(
+                self.url,
+                json=payload,
+                headers=header,
+                **kwargs,
+            ) as response:
+                self._rate_limiter.update(self.url, response.status, response.headers)
+                if response.status > 299:
+                    self._logger.error(f"{self._bot_id}: {response}")
+                    text = await response.text()
+                    txt = f"Unexpected response {response.status} {text}"
+
+                    if response.status == 400:
+                        raise BadRequest(txt)
+                    elif response.status == 429:
+                        # the limiter holds the next attempt until Retry-After
+                        continue
+                    elif response.status == 401:
+                        raise NotAuthorized(txt)
+                    raise GenericRequestError(txt)
+                return await response.text()
 
     async def send_prompt(self, prompt: str):
         options = [{"type": 3, "name": "prompt", "value": prompt}]
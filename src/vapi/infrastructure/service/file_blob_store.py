@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from typing import AsyncIterator, Optional
+
+from vapi.application import IBlobStore, NotInCollection
+
+
+class FileBlobStore(IBlobStore):
+    """content-addressed blobs on the local filesystem.
+    Derived blobs live apart, sweep() drops the least recently used of them
+    once they take more than max_derived_bytes on disk, whoever wrote them"""
+
+    chunk_size = 64 * 1024
+    touch_after = 60  # seconds, how stale a derived blob's last use stamp may get
+
+    def __init__(self, root: str, max_derived_bytes: Optional[int] = None) -> None:
+        self._root = root
+        self._max_derived_bytes = max_derived_bytes
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def _path(self, key: str, derived: bool = False) -> str:
+        if os.sep in key or key.startswith("."):
+            raise NotInCollection(f"{key} was not found")
+        if derived:
+            return os.path.join(self._root, "derived", key[:2], key)
+        return os.path.join(self._root, key[:2], key[2:4], key)
+
+    def _open(self, key: str):
+        try:
+            return open(self._path(key), "rb")
+        except FileNotFoundError:
+            pass
+        path = self._path(key, derived=True)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            raise NotInCollection(f"{key} was not found")
+        # mtime is the last use: atime isn't kept on relatime/noatime mounts
+        if time.time() - os.fstat(f.fileno()).st_mtime > self.touch_after:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return f
+
+    def _sweep(self):
+        found = []
+        for dirpath, _, files in os.walk(os.path.join(self._root, "derived")):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, st.st_size, path))
+        found.sort()
+        total = sum(size for _, size, _ in found)
+        # the newest blob stays even if it alone exceeds the limit
+        for _, size, path in found[:-1]:
+            if total <= self._max_derived_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    async def sweep(self):
+        if self._max_derived_bytes is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._sweep)
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], suffix: str = "") -> str:
+        loop = asyncio.get_running_loop()
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self._root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    await loop.run_in_executor(None, f.write, chunk)
+            key = digest.hexdigest() + suffix
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return key
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self._root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def put(self, key: str, data: bytes):
+        path = self._path(key, derived=True)
+        await asyncio.get_running_loop().run_in_executor(None, self._write, path, data)
+
+    async def size(self, key: str) -> int:
+        with self._open(key) as f:
+            return os.fstat(f.fileno()).st_size
+
+    async def read(
+        self, key: str, start: int = 0, end: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        with self._open(key) as f:
+            f.seek(start)
+            left = None if end is None else end - start + 1
+            while left is None or left > 0:
+                n = self.chunk_size if left is None else min(self.chunk_size, left)
+                chunk = await loop.run_in_executor(None, f.read, n)
+                if not chunk:
+                    return
+                if left is not None:
+                    left -= len(chunk)
+                yield chunk
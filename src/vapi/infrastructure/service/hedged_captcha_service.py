@@ -0,0 +1,69 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+from vapi.application import ICaptchaService, NotFound
+
+from ..counters import SERVICE_LATENCY
+from ..http_base import HttpCaptchaService
+
+
+class HedgedCaptchaService(HttpCaptchaService):
+    """asks the next provider whenever the previous ones are slow or failed"""
+
+    def __init__(
+        self,
+        providers: List[ICaptchaService],
+        hedge_after: float = 15,
+        session: Optional[aiohttp.ClientSession] = None,
+    ) -> None:
+        super().__init__(session)
+        self._providers = providers
+        self._hedge_after = hedge_after
+        self._names = [f"{type(p).__name__}#{i}" for i, p in enumerate(providers)]
+
+    async def _timed(self, idx: int, img: bytes, labels: List[str]) -> str:
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            label = await self._providers[idx].solve_image(img, labels)
+            if label not in labels:
+                raise NotFound(f"{self._names[idx]} answered {label}")
+            outcome = "ok"
+            return label
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            SERVICE_LATENCY.labels(
+                self.__class__.__name__, self._names[idx], outcome
+            ).observe(time.monotonic() - start)
+
+    async def solve_image(self, img: bytes, labels: List[str]) -> str:
+        running: Dict["asyncio.Task[str]", int] = {}
+        errors: List[str] = []
+        started = 0
+        try:
+            while True:
+                if started < len(self._providers):
+                    t = asyncio.create_task(self._timed(started, img, labels))
+                    running[t] = started
+                    started += 1
+                if not running:
+                    raise NotFound(f"no provider solved the captcha {errors}")
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=self._hedge_after
+                    if started < len(self._providers)
+                    else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for t in done:
+                    idx = running.pop(t)
+                    if t.exception() is None:
+                        return t.result()
+                    errors.append(f"{self._names[idx]}: {t.exception()}")
+        finally:
+            for t in running:
+                t.cancel()
@@ -0,0 +1,127 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from PIL import Image
+from vapi.application import IBlobStore, ImagePosition, NotInCollection
+
+formats = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP"}
+
+
+def crop_tiles(data: bytes, fmt: str, quality: int) -> Dict[ImagePosition, bytes]:
+    """the four images of a 2x2 grid, decoding it once"""
+    image = Image.open(BytesIO(data))
+    image.load()
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    w, h = image.width // 2, image.height // 2
+    tiles = {}
+    for pos in ImagePosition:
+        x, y = (pos.value - 1) % 2 * w, (pos.value - 1) // 2 * h
+        buf = BytesIO()
+        image.crop((x, y, x + w, y + h)).save(buf, format=fmt, quality=quality)
+        tiles[pos] = buf.getvalue()
+    return tiles
+
+
+def make_thumbnails(
+    data: bytes, sizes: Tuple[int, ...], fmt: str, quality: int
+) -> Dict[int, bytes]:
+    """thumbnails fitting size x size, all out of one reduced decode"""
+    image = Image.open(BytesIO(data))
+    image.draft("RGB", (max(sizes), max(sizes)))
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    thumbs = {}
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size))
+        buf = BytesIO()
+        image.save(buf, format=fmt, quality=quality)
+        thumbs[size] = buf.getvalue()
+    return thumbs
+
+
+class ImageVariants:
+    """images derived from stored deliverables, cached in the blob store"""
+
+    def __init__(
+        self,
+        blob_store: IBlobStore,
+        sizes: Tuple[int, ...] = (256, 512),
+        fmt: str = "webp",
+        quality: int = 80,
+        workers: int = 2,
+    ) -> None:
+        self._blob_store = blob_store
+        self.sizes = tuple(sizes)
+        self._fmt = fmt
+        self._quality = quality
+        self._workers = workers
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, "asyncio.Future[None]"] = {}
+
+    async def _cached(self, key: str) -> bool:
+        try:
+            await self._blob_store.size(key)
+            return True
+        except NotInCollection:
+            return False
+
+    async def _derive(self, key: str, keys: Dict[Any, str], fn: Callable, *args: Any):
+        data = b"".join([chunk async for chunk in self._blob_store.read(key)])
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self._workers)
+        results = await asyncio.get_running_loop().run_in_executor(
+            self._processes, fn, data, *args
+        )
+        for k, blob in results.items():
+            await self._blob_store.put(keys[k], blob)
+
+    async def _once(
+        self, job_id: str, key: str, keys: Dict[Any, str], fn: Callable, *args: Any
+    ):
+        # one decode serves every variant of the job, concurrent requests share it
+        job = self._inflight.get(job_id)
+        if job is None:
+            job = asyncio.ensure_future(self._derive(key, keys, fn, *args))
+            self._inflight[job_id] = job
+            job.add_done_callback(lambda _: self._inflight.pop(job_id, None))
+        await asyncio.shield(job)
+
+    async def tile(
+        self,
+        key: str,
+        position: ImagePosition,
+        fmt: Optional[str] = None,
+        quality: int = 90,
+    ) -> str:
+        """key of the cropped image, fmt is one of formats or the source's"""
+        base, ext = os.path.splitext(key)
+        ext = f".{fmt}" if fmt else ext
+        out = formats.get(ext[1:].lower(), "PNG")
+        suffix = f"_q{quality}{ext}" if out != "PNG" else ext
+        keys = {pos: f"{base}_{pos.value}{suffix}" for pos in ImagePosition}
+        if not await self._cached(keys[position]):
+            await self._once(base + suffix, key, keys, crop_tiles, out, quality)
+        return keys[position]
+
+    async def thumbnails(self, key: str) -> Dict[int, str]:
+        """keys of all configured thumbnail sizes"""
+        base, _ = os.path.splitext(key)
+        keys = {size: f"{base}_t{size}.{self._fmt}" for size in self.sizes}
+        out = formats[self._fmt]
+        await self._once(
+            base + "_t", key, keys, make_thumbnails, self.sizes, out, self._quality
+        )
+        return keys
+
+    async def thumbnail(self, key: str, size: int) -> str:
+        base, _ = os.path.splitext(key)
+        thumb = f"{base}_t{size}.{self._fmt}"
+        if size not in self.sizes:
+            raise ValueError(f"{size} is not one of {self.sizes}")
+        if not await self._cached(thumb):
+            await self.thumbnails(key)
+        return thumb
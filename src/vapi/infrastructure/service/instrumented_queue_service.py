@@ -0,0 +1,157 @@
+import time
+from datetime import timedelta
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, List,
+                    Optional, TypeVar)
+from uuid import UUID
+
+from vapi.application import (DequeuedTask, IQueueService, PoolStats,
+                              RouteLabel, Task)
+
+from ..counters import QUEUE_SERVICE_CALLS, QUEUE_SERVICE_LATENCY
+
+T = TypeVar("T")
+
+
+class InstrumentedQueueService(IQueueService):
+    """counts and times every call to the wrapped queue service.
+    payload bytes are counted by the redis repo, where they're encoded"""
+
+    def __init__(self, queue_service: IQueueService) -> None:
+        self._queue_service = queue_service
+
+    async def _call(self, method: str, awaitable: Awaitable[T]) -> T:
+        start = time.perf_counter()
+        try:
+            result = await awaitable
+        except Exception:
+            QUEUE_SERVICE_CALLS.labels(method, "error").inc()
+            raise
+        finally:
+            QUEUE_SERVICE_LATENCY.labels(method).observe(time.perf_counter() - start)
+        QUEUE_SERVICE_CALLS.labels(method, "ok").inc()
+        return result
+
+    async def get_next_task_id(self, route_label: RouteLabel) -> Optional[UUID]:
+        return await self._call(
+            "get_next_task_id", self._queue_service.get_next_task_id(route_label)
+        )
+
+    async def get_first_task_id(
+        self,
+        route_labels: List[RouteLabel],
+        bot_id: Optional[int] = None,
+        visibility: Optional[timedelta] = None,
+    ) -> Optional[DequeuedTask]:
+        return await self._call(
+            "get_first_task_id",
+            self._queue_service.get_first_task_id(route_labels, bot_id, visibility),
+        )
+
+    async def wait_first_task_id(
+        self,
+        route_labels: List[RouteLabel],
+        timeout: float,
+        bot_id: Optional[int] = None,
+        visibility: Optional[timedelta] = None,
+    ) -> Optional[DequeuedTask]:
+        return await self._call(
+            "wait_first_task_id",
+            self._queue_service.wait_first_task_id(
+                route_labels, timeout, bot_id, visibility
+            ),
+        )
+
+    async def release_task(self, uid: UUID, bot_pool: str, bot_id: int) -> bool:
+        return await self._call(
+            "release_task", self._queue_service.release_task(uid, bot_pool, bot_id)
+        )
+
+    async def reap_tasks(
+        self, bot_pool: str, bot_id: Optional[int] = None
+    ) -> List[Task]:
+        return await self._call(
+            "reap_tasks", self._queue_service.reap_tasks(bot_pool, bot_id)
+        )
+
+    async def get_task_by_id(self, uid: UUID, touch: bool = False) -> Task:
+        return await self._call(
+            "get_task_by_id", self._queue_service.get_task_by_id(uid, touch)
+        )
+
+    async def get_tasks_by_ids(self, uids: List[UUID]) -> Dict[UUID, Optional[Task]]:
+        return await self._call(
+            "get_tasks_by_ids", self._queue_service.get_tasks_by_ids(uids)
+        )
+
+    async def del_task_by_id(self, uid: UUID):
+        return await self._call(
+            "del_task_by_id", self._queue_service.del_task_by_id(uid)
+        )
+
+    async def put_task(self, task: Task):
+        return await self._call("put_task", self._queue_service.put_task(task))
+
+    def listen_task_events(
+        self, accept: Optional[Callable[[UUID], bool]] = None
+    ) -> AsyncIterator[Task]:
+        # subscriptions are long lived, only their start is counted
+        QUEUE_SERVICE_CALLS.labels("listen_task_events", "ok").inc()
+        return self._queue_service.listen_task_events(accept)
+
+    async def create_and_publish(self, task: Task) -> bool:
+        return await self._call(
+            "create_and_publish", self._queue_service.create_and_publish(task)
+        )
+
+    async def create_and_publish_many(self, tasks: List[Task]) -> List[bool]:
+        return await self._call(
+            "create_and_publish_many",
+            self._queue_service.create_and_publish_many(tasks),
+        )
+
+    async def update_task_fields(self, uid: UUID, **fields: Any) -> bool:
+        return await self._call(
+            "update_task_fields",
+            self._queue_service.update_task_fields(uid, **fields),
+        )
+
+    async def publish_task(self, uid: UUID, route_label: RouteLabel):
+        return await self._call(
+            "publish_task", self._queue_service.publish_task(uid, route_label)
+        )
+
+    async def push_back_task_id(self, task_id: str, route_label: RouteLabel):
+        return await self._call(
+            "push_back_task_id",
+            self._queue_service.push_back_task_id(task_id, route_label),
+        )
+
+    async def map_msg2task(self, msg_id: int, task_id: UUID):
+        return await self._call(
+            "map_msg2task", self._queue_service.map_msg2task(msg_id, task_id)
+        )
+
+    async def lookup_task_by_msg(self, msg_id: int) -> UUID:
+        return await self._call(
+            "lookup_task_by_msg", self._queue_service.lookup_task_by_msg(msg_id)
+        )
+
+    async def get_queue_len(self, route_label: RouteLabel) -> int:
+        return await self._call(
+            "get_queue_len", self._queue_service.get_queue_len(route_label)
+        )
+
+    async def put_ticket(self, route_label: RouteLabel):
+        return await self._call(
+            "put_ticket", self._queue_service.put_ticket(route_label)
+        )
+
+    async def count_tickets(self, route_label: RouteLabel) -> int:
+        return await self._call(
+            "count_tickets", self._queue_service.count_tickets(route_label)
+        )
+
+    async def get_pool_stats(self, bot_pool: str) -> PoolStats:
+        return await self._call(
+            "get_pool_stats", self._queue_service.get_pool_stats(bot_pool)
+        )
@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from uuid import UUID
+
+import vapi.infrastructure.counters as cnt
+from vapi.application import IQueueService, NotInCollection
+
+
+class MsgTaskCache:
+    """bounded LRU+TTL cache in front of the message id -> task id mapping"""
+
+    def __init__(
+        self,
+        queue_service: IQueueService,
+        name: str,
+        maxsize: int = 1024,
+        ttl: float = 600,
+        negative_ttl: float = 2,
+    ) -> None:
+        self._queue_service = queue_service
+        self._name = name
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._entries: "OrderedDict[int, Tuple[float, Optional[UUID]]]" = OrderedDict()
+
+    def _store(self, msg_id: int, task_id: Optional[UUID]):
+        ttl = self._ttl if task_id is not None else self._negative_ttl
+        self._entries[msg_id] = (time.monotonic() + ttl, task_id)
+        self._entries.move_to_end(msg_id)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    async def map(self, msg_id: int, task_id: UUID):
+        await self._queue_service.map_msg2task(msg_id, task_id)
+        self._store(msg_id, task_id)
+
+    async def lookup(self, msg_id: int) -> UUID:
+        entry = self._entries.get(msg_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(msg_id)
+            cnt.MSG_CACHE_HIT.labels(self._name).inc()
+            if entry[1] is None:
+                raise NotInCollection(f"{msg_id} was not found")
+            return entry[1]
+        cnt.MSG_CACHE_MISS.labels(self._name).inc()
+        try:
+            task_id = await self._queue_service.lookup_task_by_msg(msg_id)
+        except NotInCollection:
+            self._store(msg_id, None)
+            raise
+        self._store(msg_id, task_id)
+        return task_id
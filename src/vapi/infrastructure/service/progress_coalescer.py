@@ -0,0 +1,73 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from loguru import logger
+from vapi.application import IQueueService, Outcome
+
+
+class ProgressCoalescer:
+    """keeps the latest progress per task and writes it out once per interval"""
+
+    max_finished = 1024  # late edits of that many finished tasks are dropped
+
+    def __init__(self, queue_service: IQueueService, interval: float = 5.0) -> None:
+        self._queue_service = queue_service
+        self._interval = interval
+        self._pending: Dict[UUID, int] = {}
+        self._written: Dict[UUID, int] = {}
+        self._first: Dict[UUID, Optional[datetime]] = {}  # None once written
+        self._finished: "OrderedDict[UUID, None]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def begin(self, uid: UUID):
+        # a new run of a finished task (variation) reports progress again
+        self._finished.pop(uid, None)
+
+    def push(self, uid: UUID, progress: int):
+        if uid in self._finished:
+            return
+        if uid not in self._first:
+            self._first[uid] = datetime.utcnow()
+        if self._written.get(uid) != progress:
+            self._pending[uid] = progress
+        else:
+            self._pending.pop(uid, None)
+
+    def forget(self, uid: UUID):
+        self._pending.pop(uid, None)
+        self._written.pop(uid, None)
+        self._first.pop(uid, None)
+
+    async def flush(self):
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            for uid, progress in pending.items():
+                fields: Dict[str, Any] = {"progress": progress}
+                if self._first.get(uid) is not None:
+                    fields["first_progress_at"] = self._first[uid]
+                try:
+                    if await self._queue_service.update_task_fields(uid, **fields):
+                        self._written[uid] = progress
+                        self._first[uid] = None
+                except Exception as ex:
+                    logger.bind(human="coalescer").error(f"{uid} {ex}")
+
+    async def write(self, uid: UUID, **fields: Any) -> bool:
+        # status changes and final outcomes bypass the buffer and supersede it
+        async with self._lock:
+            if self._first.get(uid) is not None:
+                fields.setdefault("first_progress_at", self._first[uid])
+            self.forget(uid)
+            if fields.get("status") in (Outcome.Success, Outcome.Failure):
+                self._finished[uid] = None
+                if len(self._finished) > self.max_finished:
+                    self._finished.popitem(last=False)
+            return await self._queue_service.update_task_fields(uid, **fields)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.flush()
@@ -0,0 +1,44 @@
+import re
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+
+class PromptIndex:
+    """normalized prompts of in-flight generations, matched against MJ messages"""
+
+    clean_str = re.compile(r"[^A-Za-z]")
+    re_url = re.compile(r"http(s)?://[^\s]+")
+    percent_re = re.compile(r"\d+%")
+
+    def __init__(self) -> None:
+        self._prompts: Dict[UUID, Tuple[str, int]] = {}
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        return cls.clean_str.sub(
+            "", cls.percent_re.split(cls.re_url.sub("", text))[0].split("--")[0]
+        )
+
+    def add(self, uid: UUID, prompt: str):
+        if prompt:
+            self._prompts[uid] = (self.normalize(prompt), len(prompt))
+
+    def discard(self, uid: UUID):
+        self._prompts.pop(uid, None)
+
+    def __contains__(self, uid: UUID) -> bool:
+        return uid in self._prompts
+
+    def __len__(self) -> int:
+        return len(self._prompts)
+
+    def match(self, *texts: Optional[str]) -> Optional[UUID]:
+        """the task with the shortest prompt contained in any of texts"""
+        normalized = [self.normalize(t) for t in texts if t]
+        best: Optional[Tuple[int, UUID]] = None
+        for uid, (prompt, length) in self._prompts.items():
+            if (best is None or length < best[0]) and any(
+                prompt in t for t in normalized
+            ):
+                best = (length, uid)
+        return best[1] if best is not None else None
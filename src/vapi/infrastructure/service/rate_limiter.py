@@ -0,0 +1,84 @@
+import asyncio
+import time
+from typing import Dict, Mapping, Optional
+
+import vapi.infrastructure.counters as cnt
+
+
+class _Bucket:
+    def __init__(self) -> None:
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+class DiscordRateLimiter:
+    """schedules requests of one account by discord's X-RateLimit-* headers"""
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._routes: Dict[str, str] = {}  # route -> bucket id reported by discord
+        self._buckets: Dict[str, _Bucket] = {}
+        self._blocked_until = 0.0  # global limit
+
+    def _bucket(self, route: str) -> _Bucket:
+        key = self._routes.get(route, route)
+        if key not in self._buckets:
+            self._buckets[key] = _Bucket()
+        return self._buckets[key]
+
+    async def acquire(self, route: str):
+        cnt.RATE_LIMIT_QUEUED.labels(self._name).inc()
+        try:
+            while not await self._take(route):
+                pass
+        finally:
+            cnt.RATE_LIMIT_QUEUED.labels(self._name).dec()
+
+    async def _take(self, route: str) -> bool:
+        """waits for a slot in the route's bucket, False if the route has moved
+        to another bucket meanwhile and the wait must start over there"""
+        bucket = self._bucket(route)
+        async with bucket.lock:
+            while True:
+                if self._bucket(route) is not bucket:
+                    return False
+                now = time.monotonic()
+                delay = self._blocked_until - now
+                if bucket.remaining == 0 and bucket.reset_at > now:
+                    delay = max(delay, bucket.reset_at - now)
+                if delay <= 0:
+                    break
+                cnt.RATE_LIMIT_WAIT.labels(self._name).inc(delay)
+                await asyncio.sleep(delay)
+            if bucket.reset_at <= time.monotonic():
+                bucket.remaining = None
+            if bucket.remaining is not None:
+                bucket.remaining -= 1
+        return True
+
+    def update(self, route: str, status: int, headers: Mapping[str, str]):
+        now = time.monotonic()
+        bucket_id = headers.get("X-RateLimit-Bucket")
+        if bucket_id is not None and self._routes.get(route) != bucket_id:
+            bucket = self._buckets.pop(self._routes.get(route, route), None)
+            self._routes[route] = bucket_id
+            if bucket is not None and bucket_id not in self._buckets:
+                self._buckets[bucket_id] = bucket
+        bucket = self._bucket(route)
+        try:
+            if "X-RateLimit-Remaining" in headers:
+                bucket.remaining = int(headers["X-RateLimit-Remaining"])
+            if "X-RateLimit-Reset-After" in headers:
+                bucket.reset_at = now + float(headers["X-RateLimit-Reset-After"])
+            if status == 429:
+                retry_after = float(headers.get("Retry-After", 1))
+                if headers.get("X-RateLimit-Global", "").lower() == "true":
+                    self._blocked_until = now + retry_after
+                    cnt.RATE_LIMITED.labels(self._name, "global").inc()
+                else:
+                    bucket.remaining = 0
+                    bucket.reset_at = max(bucket.reset_at, now + retry_after)
+                    cnt.RATE_LIMITED.labels(self._name, "bucket").inc()
+        except ValueError:
+            pass
@@ -1,18 +1,251 @@
+import asyncio
 import json
-from datetime import timedelta
-from typing import Optional
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 from uuid import UUID
 
 import vapi.infrastructure.counters as cnt
-from vapi.application import IQueueService, NotInCollection, RouteLabel, Task
+from pydantic import ValidationError
+from pydantic.json import pydantic_encoder
+from redis import Redis
+from redis.exceptions import ResponseError, WatchError
+from vapi.application import (DequeuedTask, IQueueService, NotInCollection,
+                              Outcome, PoolStats, Priority, RouteLabel, Task)
 
 from ..redis_base import RedisVolatileRepo
 
 
 class RedisQueueRepo(RedisVolatileRepo, IQueueService):
     task_queue = "queue"
+    task_events = "task_events"
     ttl = timedelta(hours=24)
 
+    inflight = "inflight"
+    tickets = "tickets"
+    ticket_ttl = timedelta(minutes=5)
+
+    # wake-up tokens of the bots waiting on a queue, one per push to it
+    notify = "notify"
+    notify_max = 64
+    notify_ttl = timedelta(minutes=1)
+
+    # pops from the first non-empty queue of KEYS and reports all their lengths:
+    # {index of the queue (1-based, 0 if all are empty), task id, len1, len2, ...}
+    # when ARGV[1] == "1" the last two KEYS are the in-flight zset/owner hash
+    # and the popped id is leased there till ARGV[2] for bot ARGV[3]
+    _get_first_lua = """
+local n = #KEYS
+local lease = ARGV[1] == "1"
+if lease then
+    n = n - 2
+end
+local found = 0
+local task_id = false
+local lens = {}
+for i = 1, n do
+    if found == 0 then
+        task_id = redis.call('RPOP', KEYS[i])
+        if task_id then
+            found = i
+        end
+    end
+    lens[i] = redis.call('LLEN', KEYS[i])
+end
+if found > 0 and lease then
+    redis.call('ZADD', KEYS[n + 1], ARGV[2], task_id)
+    redis.call('HSET', KEYS[n + 2], task_id, ARGV[3])
+end
+return {found, task_id, unpack(lens)}
+"""
+
+    # claims in-flight ids whose lease expired before ARGV[1] and, if ARGV[2] is
+    # a bot id, those of the bot which never left New status (bot restarted)
+    _reap_lua = """
+local claimed = {}
+local function status_of(task_id)
+    if redis.call('TYPE', task_id).ok == 'string' then
+        -- stored as json before tasks became hashes
+        return '"' .. cjson.decode(redis.call('GET', task_id)).status .. '"'
+    end
+    return redis.call('HGET', task_id, 'status')
+end
+local function claim(task_id)
+    redis.call('ZREM', KEYS[1], task_id)
+    redis.call('HDEL', KEYS[2], task_id)
+    table.insert(claimed, task_id)
+end
+for _, task_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])) do
+    claim(task_id)
+end
+if ARGV[2] ~= "" then
+    local owners = redis.call('HGETALL', KEYS[2])
+    for i = 1, #owners, 2 do
+        if owners[i + 1] == ARGV[2] then
+            local status = status_of(owners[i])
+            if not status or status == '"New"' then
+                claim(owners[i])
+            end
+        end
+    end
+end
+return claimed
+"""
+
+    # drops the lease of ARGV[1] only if bot ARGV[2] still owns it: returns 1 if so
+    _release_lua = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+
+    # KEYS are pairs of queue/tickets zset: returns len and live tickets of each
+    _pool_stats_lua = """
+local result = {}
+for i = 1, #KEYS, 2 do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i + 1], '-inf', ARGV[1])
+    table.insert(result, redis.call('LLEN', KEYS[i]))
+    table.insert(result, redis.call('ZCARD', KEYS[i + 1]))
+end
+return result
+"""
+
+    # stores the task (field/value pairs from ARGV[5]) unless its key exists and
+    # only then enqueues it and wakes a bot up via KEYS[3]:
+    # returns the queue length or -1 on conflict
+    _create_lua = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return -1
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 5))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+local length = redis.call('LPUSH', KEYS[2], ARGV[2])
+redis.call('LPUSH', KEYS[3], 1)
+redis.call('LTRIM', KEYS[3], 0, ARGV[3] - 1)
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return length
+"""
+
+    # overwrites some fields (pairs from ARGV[4]) of an existing task and
+    # publishes the whole task to channel KEYS[2]: returns 0 if there's no task.
+    # if ARGV[2] isn't empty, only while that field still holds ARGV[3]
+    _update_lua = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if ARGV[2] ~= "" and redis.call('HGET', KEYS[1], ARGV[2]) ~= ARGV[3] then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+local fields = redis.call('HGETALL', KEYS[1])
+local task = {}
+for i = 1, #fields, 2 do
+    task[fields[i]] = fields[i + 1]
+end
+redis.call('PUBLISH', KEYS[2], cjson.encode(task))
+return 1
+"""
+
+    def __init__(self, redis: Redis, pool_stats_ttl: float = 1.0) -> None:
+        super().__init__(redis)
+        self._get_first = self._redis.register_script(self._get_first_lua)
+        self._reap = self._redis.register_script(self._reap_lua)
+        self._release = self._redis.register_script(self._release_lua)
+        self._pool_stats_q = self._redis.register_script(self._pool_stats_lua)
+        self._create = self._redis.register_script(self._create_lua)
+        self._update = self._redis.register_script(self._update_lua)
+        # all bots of the process share the snapshot of their pool
+        self._pool_stats_ttl = pool_stats_ttl
+        self._pool_stats: Dict[str, Tuple[float, PoolStats]] = {}
+        self._pool_stats_locks: Dict[str, asyncio.Lock] = {}
+
+    # tasks are hashes of their top level fields, each value json encoded
+    @staticmethod
+    def _task2hash(task: Task) -> Dict[str, str]:
+        return {
+            k: json.dumps(v, default=pydantic_encoder) for k, v in task.dict().items()
+        }
+
+    @staticmethod
+    def _hash2task(c: Dict[str, str]) -> Task:
+        return Task(**{k: json.loads(v) for k, v in c.items()})
+
+    @staticmethod
+    def _hash_len(c: Dict[str, str]) -> int:
+        # json.dumps escapes non-ascii, so characters are bytes here
+        return sum(len(k) + len(v) for k, v in c.items())
+
+    @staticmethod
+    def _weigh(method: str, direction: str, size: int):
+        cnt.QUEUE_SERVICE_BYTES.labels(method, direction).inc(size)
+
+    @staticmethod
+    def _wrong_type(ex: ResponseError) -> bool:
+        return str(ex).startswith("WRONGTYPE")
+
+    async def _upgrade_legacy(self, key: str) -> Dict[str, str]:
+        """tasks stored before they became hashes are json strings:
+        such a key is rewritten as a hash the first time it's touched"""
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                raw = await pipe.get(key)
+                ttl = await pipe.ttl(key)
+                c = self._task2hash(Task.parse_raw(raw)) if raw is not None else {}
+                pipe.multi()
+                pipe.delete(key)
+                if c:
+                    pipe.hset(key, mapping=c)
+                    pipe.expire(key, ttl if ttl > 0 else self.ttl)
+                await pipe.execute()
+            return c
+        except (WatchError, ResponseError):
+            # upgraded by someone else meanwhile
+            return await self._redis.hgetall(key)
+
+    async def _get_hashes(self, keys: List[str]) -> List[Dict[str, str]]:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            c = await pipe.execute(raise_on_error=False)
+        for i, (key, r) in enumerate(zip(keys, c)):
+            if isinstance(r, ResponseError):
+                if not self._wrong_type(r):
+                    raise r
+                c[i] = await self._upgrade_legacy(key)
+        return c
+
+    @staticmethod
+    def _flatten(mapping: Dict[str, str]) -> List[str]:
+        return [i for kv in mapping.items() for i in kv]
+
+    @classmethod
+    def _get_tickets_name(cls, route_label: RouteLabel) -> str:
+        # one zset per queue: member = bot id, score = ticket expiration time
+        q_nm = cls._get_q_name_by_prior(
+            RouteLabel(priority=route_label.priority, bot_pool=route_label.bot_pool)
+        )
+        return f"{cls.tickets}_{q_nm}"
+
+    @classmethod
+    def _get_inflight_names(cls, bot_pool: str) -> List[str]:
+        return [f"{cls.inflight}_{bot_pool}", f"{cls.inflight}_{bot_pool}_owner"]
+
+    @classmethod
+    def _get_notify_name(cls, route_label: RouteLabel) -> str:
+        return f"{cls.notify}_{cls._get_q_name_by_prior(route_label)}"
+
+    def _notify(self, pipe, route_label: RouteLabel):
+        key = self._get_notify_name(route_label)
+        pipe.lpush(key, 1)
+        pipe.ltrim(key, 0, self.notify_max - 1)
+        pipe.expire(key, self.notify_ttl)
+
     @classmethod
     def _get_q_name_by_prior(cls, route_label: RouteLabel):
         result = f"{cls.task_queue}_{route_label.bot_pool}_{route_label.priority.value}"
@@ -22,13 +255,58 @@ class RedisQueueRepo(RedisVolatileRepo, IQueueService):
 
     async def push_back_task_id(self, task_id: str, route_label: RouteLabel):
         q_nm = self._get_q_name_by_prior(route_label)
-        await self._redis.lpush(q_nm, task_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(q_nm, task_id)
+            self._notify(pipe, route_label)
+            await pipe.execute()
 
-    async def get_task_by_id(self, uid: UUID) -> Task:
-        c = await self._redis.get(str(uid))
-        if c is None:
+    async def get_task_by_id(self, uid: UUID, touch: bool = False) -> Task:
+        try:
+            if touch:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(str(uid))
+                    pipe.expire(str(uid), self.ttl)
+                    c, _ = await pipe.execute()
+            else:
+                c = await self._redis.hgetall(str(uid))
+        except ResponseError as ex:
+            if not self._wrong_type(ex):
+                raise
+            c = await self._upgrade_legacy(str(uid))
+        if not c:
             raise NotInCollection(f"{uid} was not found")
-        return Task(**json.loads(c))
+        self._weigh("get_task_by_id", "received", self._hash_len(c))
+        return self._hash2task(c)
+
+    async def get_tasks_by_ids(self, uids: List[UUID]) -> Dict[UUID, Optional[Task]]:
+        if not uids:
+            return {}
+        c = await self._get_hashes([str(uid) for uid in uids])
+        self._weigh("get_tasks_by_ids", "received", sum(map(self._hash_len, c)))
+        return {uid: self._hash2task(t) if t else None for uid, t in zip(uids, c)}
+
+    async def update_task_fields(self, uid: UUID, **fields: Any) -> bool:
+        mapping = {}
+        for k, v in fields.items():
+            if k not in Task.__fields__ or k == "uuid":
+                raise ValueError(f"{k} is not an updatable Task field")
+            v, err = Task.__fields__[k].validate(v, {}, loc=k, cls=Task)
+            if err:
+                raise ValidationError([err], Task)
+            mapping[k] = json.dumps(v, default=pydantic_encoder)
+        if not mapping:
+            return True
+        self._weigh("update_task_fields", "sent", self._hash_len(mapping))
+        keys = [str(uid), self.task_events]
+        args = [int(self.ttl.total_seconds()), "", "", *self._flatten(mapping)]
+        try:
+            updated = await self._update(keys=keys, args=args)
+        except ResponseError as ex:
+            if not self._wrong_type(ex):
+                raise
+            await self._upgrade_legacy(str(uid))
+            updated = await self._update(keys=keys, args=args)
+        return bool(updated)
 
     async def get_next_task_id(self, route_label: RouteLabel) -> Optional[UUID]:
         q_nm = self._get_q_name_by_prior(route_label)
@@ -38,14 +316,190 @@ class RedisQueueRepo(RedisVolatileRepo, IQueueService):
         if c is not None:
             return UUID(c)
 
-    async def put_task(self, task: Task):
-        await self._redis.set(
-            str(task.uuid), value=task.json(), ex=int(self.ttl.total_seconds())
+    async def get_first_task_id(
+        self,
+        route_labels: List[RouteLabel],
+        bot_id: Optional[int] = None,
+        visibility: Optional[timedelta] = None,
+    ) -> Optional[DequeuedTask]:
+        if not route_labels:
+            return None
+        q_nms = [self._get_q_name_by_prior(rl) for rl in route_labels]
+        keys, args = list(q_nms), ["0"]
+        if visibility is not None:
+            if bot_id is None:
+                raise ValueError("bot_id is empty")
+            keys += self._get_inflight_names(route_labels[0].bot_pool)
+            args = ["1", time.time() + visibility.total_seconds(), bot_id]
+        found, task_id, *lens = await self._get_first(keys=keys, args=args)
+        for q_nm, length in zip(q_nms, lens):
+            cnt.INC_QUEUE_LEN.labels(q_nm).set(length)
+        if not found:
+            return None
+        return DequeuedTask(
+            task_id=UUID(task_id),
+            route_label=route_labels[found - 1],
+            queue_lens=lens,
+        )
+
+    async def wait_first_task_id(
+        self,
+        route_labels: List[RouteLabel],
+        timeout: float,
+        bot_id: Optional[int] = None,
+        visibility: Optional[timedelta] = None,
+    ) -> Optional[DequeuedTask]:
+        deadline = time.monotonic() + timeout
+        while True:
+            dequeued = await self.get_first_task_id(route_labels, bot_id, visibility)
+            left = deadline - time.monotonic()
+            if dequeued is not None or not route_labels or left <= 0:
+                return dequeued
+            # all queues are empty: park the connection till a push wakes us up.
+            # the token is only a signal, the id itself is popped and leased in
+            # one step by get_first_task_id so a cancellation here loses nothing.
+            # BLPOP on several keys and an integer timeout work on any Redis
+            # version. only the bot's own queues wake it: a token taken by a bot
+            # which can't pop from that queue would leave the right one asleep
+            await self._redis.blpop(
+                [self._get_notify_name(label) for label in route_labels],
+                math.ceil(left),
+            )
+
+    async def release_task(self, uid: UUID, bot_pool: str, bot_id: int) -> bool:
+        released = await self._release(
+            keys=self._get_inflight_names(bot_pool), args=[str(uid), bot_id]
+        )
+        return bool(released)
+
+    async def reap_tasks(
+        self, bot_pool: str, bot_id: Optional[int] = None
+    ) -> List[Task]:
+        claimed = await self._reap(
+            keys=self._get_inflight_names(bot_pool),
+            args=[time.time(), "" if bot_id is None else bot_id],
         )
+        if not claimed:
+            return []
+        requeued, pending = [], []
+        tasks = await self._get_hashes(claimed)
+        self._weigh("reap_tasks", "received", sum(map(self._hash_len, tasks)))
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for c in tasks:
+                if not c:
+                    # already expired
+                    continue
+                task = self._hash2task(c)
+                if task.status == Outcome.New:
+                    # to the head of its queue, it has waited enough
+                    q_nm = self._get_q_name_by_prior(task.route_label)
+                    pipe.rpush(q_nm, str(task.uuid))
+                    self._notify(pipe, task.route_label)
+                    requeued.append(task)
+                elif task.status == Outcome.Pending:
+                    pending.append(task)
+            await pipe.execute()
+        return requeued + await self._fail_pending(pending)
+
+    async def _fail_pending(self, tasks: List[Task]) -> List[Task]:
+        """marks the tasks failed unless their bot has finished them meanwhile,
+        returns the failed ones"""
+        if not tasks:
+            return []
+        completed_at = datetime.utcnow()
+        mapping = {
+            "status": json.dumps(Outcome.Failure),
+            "completed_at": json.dumps(completed_at, default=pydantic_encoder),
+        }
+        args = [
+            int(self.ttl.total_seconds()),
+            "status",
+            json.dumps(Outcome.Pending),
+            *self._flatten(mapping),
+        ]
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for task in tasks:
+                await self._update(
+                    keys=[str(task.uuid), self.task_events], args=args, client=pipe
+                )
+            updated = await pipe.execute()
+        self._weigh("reap_tasks", "sent", self._hash_len(mapping) * len(tasks))
+        failed = [task for task, ok in zip(tasks, updated) if ok]
+        for task in failed:
+            task.status = Outcome.Failure
+            task.completed_at = completed_at
+        return failed
+
+    def _put_task(self, pipe, task: Task) -> int:
+        """queues the writes on pipe, returns the bytes they send"""
+        c = self._task2hash(task)
+        message = json.dumps(c)
+        pipe.hset(str(task.uuid), mapping=c)
+        pipe.expire(str(task.uuid), self.ttl)
+        pipe.publish(self.task_events, message)
+        return self._hash_len(c) + len(message)
+
+    async def put_task(self, task: Task):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            sent = self._put_task(pipe, task)
+            await pipe.execute()
+        self._weigh("put_task", "sent", sent)
+
+    async def listen_task_events(
+        self, accept: Optional[Callable[[UUID], bool]] = None
+    ) -> AsyncIterator[Task]:
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.task_events)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                self._weigh("listen_task_events", "received", len(message["data"]))
+                c = json.loads(message["data"])
+                # the uuid alone is cheap, full validation only for wanted tasks
+                if accept is None or accept(UUID(json.loads(c["uuid"]))):
+                    yield self._hash2task(c)
+        finally:
+            await pubsub.close()
+
+    async def create_and_publish(self, task: Task) -> bool:
+        return (await self.create_and_publish_many([task]))[0]
+
+    async def create_and_publish_many(self, tasks: List[Task]) -> List[bool]:
+        q_nms = [self._get_q_name_by_prior(t.route_label) for t in tasks]
+        sent = 0
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for task, q_nm in zip(tasks, q_nms):
+                c = self._task2hash(task)
+                sent += self._hash_len(c)
+                await self._create(
+                    keys=[
+                        str(task.uuid),
+                        q_nm,
+                        self._get_notify_name(task.route_label),
+                    ],
+                    args=[
+                        int(self.ttl.total_seconds()),
+                        str(task.uuid),
+                        self.notify_max,
+                        int(self.notify_ttl.total_seconds()),
+                        *self._flatten(c),
+                    ],
+                    client=pipe,
+                )
+            lengths = await pipe.execute()
+        self._weigh("create_and_publish_many", "sent", sent)
+        for q_nm, length in zip(q_nms, lengths):
+            if length >= 0:
+                cnt.INC_QUEUE_LEN.labels(q_nm).set(length)
+        return [length >= 0 for length in lengths]
 
     async def publish_task(self, uid: UUID, route_label: RouteLabel):
         q_nm = self._get_q_name_by_prior(route_label)
-        length = await self._redis.lpush(q_nm, str(uid))
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(q_nm, str(uid))
+            self._notify(pipe, route_label)
+            length, *_ = await pipe.execute()
         cnt.INC_QUEUE_LEN.labels(q_nm).set(length)
 
     async def del_task_by_id(self, uid: UUID):
@@ -67,13 +521,42 @@ class RedisQueueRepo(RedisVolatileRepo, IQueueService):
         return await self._redis.llen(q_nm)
 
     async def count_tickets(self, route_label: RouteLabel) -> int:
-        q_nm = self._get_q_name_by_prior(route_label)
-        return len(await self._redis.keys(f"ticket_{q_nm}*"))
+        key = self._get_tickets_name(route_label)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.zcard(key)
+            _, count = await pipe.execute()
+        return count
 
     async def put_ticket(self, route_label: RouteLabel):
         if route_label.bot_id is None:
             raise ValueError("bot_id is empty")
-        key = self._get_q_name_by_prior(route_label)
-        await self._redis.set(
-            f"ticket_{key}", 1, ex=int(timedelta(minutes=5).total_seconds())
-        )
+        key = self._get_tickets_name(route_label)
+        now = time.time()
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", now)
+            pipe.zadd(key, {route_label.bot_id: now + self.ticket_ttl.total_seconds()})
+            pipe.expire(key, self.ticket_ttl)
+            await pipe.execute()
+
+    async def get_pool_stats(self, bot_pool: str) -> PoolStats:
+        lock = self._pool_stats_locks.setdefault(bot_pool, asyncio.Lock())
+        async with lock:
+            cached = self._pool_stats.get(bot_pool)
+            if cached is not None and time.monotonic() < cached[0]:
+                return cached[1]
+            keys = []
+            for p in Priority:
+                rl = RouteLabel(priority=p, bot_pool=bot_pool)
+                keys += [self._get_q_name_by_prior(rl), self._get_tickets_name(rl)]
+            c = await self._pool_stats_q(keys=keys, args=[time.time()])
+            stats = PoolStats(
+                bot_pool=bot_pool,
+                queue_len=dict(zip(Priority, c[::2])),
+                tickets=dict(zip(Priority, c[1::2])),
+            )
+            self._pool_stats[bot_pool] = (
+                time.monotonic() + self._pool_stats_ttl,
+                stats,
+            )
+            return stats
@@ -0,0 +1,47 @@
+import asyncio
+import contextlib
+from typing import AsyncIterator, Dict, Optional, Set
+from uuid import UUID
+
+from loguru import logger
+from vapi.application import IQueueService, Task
+
+
+class TaskWatcher:
+    """fans task events of one subscription out to any number of local watchers"""
+
+    max_pending = 16  # per watcher, older events are dropped when it lags behind
+
+    def __init__(self, queue_service: IQueueService) -> None:
+        self._queue_service = queue_service
+        self._watchers: Dict[UUID, Set["asyncio.Queue[Task]"]] = {}
+        self._listener: Optional["asyncio.Task[None]"] = None
+
+    async def _listen(self):
+        while True:
+            try:
+                async for task in self._queue_service.listen_task_events(
+                    self._watchers.__contains__
+                ):
+                    for q in self._watchers.get(task.uuid, ()):
+                        if q.full():
+                            q.get_nowait()
+                        q.put_nowait(task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                logger.bind(human="watcher").error(ex)
+            await asyncio.sleep(1)
+
+    @contextlib.asynccontextmanager
+    async def watch(self, uid: UUID) -> AsyncIterator["asyncio.Queue[Task]"]:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        q: "asyncio.Queue[Task]" = asyncio.Queue(self.max_pending)
+        self._watchers.setdefault(uid, set()).add(q)
+        try:
+            yield q
+        finally:
+            self._watchers[uid].discard(q)
+            if not self._watchers[uid]:
+                del self._watchers[uid]
@@ -1,46 +1,94 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from io import BytesIO
-from typing import List
+from typing import List, Optional, Tuple
 
 import aiohttp
 from twocaptcha import TwoCaptcha
-from vapi.application import ICaptchaService, NotFound
+from vapi.application import NotFound
 from vapi.utils import img2captcha
 
 from ..counters import SERVICE_ERRORS, SERVICE_USAGE
+from ..http_base import HttpCaptchaService
 
 
-class TwoCaptchasService(ICaptchaService):
-    def __init__(self, api_key: str) -> None:
+def _adapt(img_bytes: bytes, labels: List[str], fmt: str) -> Tuple[bytes, dict]:
+    return img2captcha(BytesIO(img_bytes), labels, fmt=fmt)
+
+
+class TwoCaptchasService(HttpCaptchaService):
+    def __init__(
+        self,
+        api_key: str,
+        session: Optional[aiohttp.ClientSession] = None,
+        max_concurrency: int = 4,
+        timeout: float = 180,
+        image_format: str = "PNG",
+    ) -> None:
+        super().__init__(session)
         self._api_key = api_key
-        self._solver = TwoCaptcha(self._api_key)
-
-    async def solve(self, img_url: str, labels: List[str]) -> str:
-        async with aiohttp.ClientSession() as ses:
-            async with ses.get(img_url) as resp:
-                img_bytes = await resp.read()
-                adapted, boxes = img2captcha(BytesIO(img_bytes), labels)
-                res = self._solver.coordinates(
-                    adapted.decode("utf-8"),
-                    hintText="Please select which description best fits the image",
-                    lang="en",
-                )
-                if "code" in res and ":" in res["code"]:
-                    coords = res["code"].split(":")[1]
-                    x, y = coords.split(",")
-                    _, x = x.split("=")
-                    _, y = y.split("=")
-                    for k, v in boxes.items():
-                        if (v[0] < int(x) < v[2]) and (v[1] < int(y) < v[3]):
-                            SERVICE_USAGE.labels(
-                                service=self.__class__.__name__,
-                                account=self._api_key[:-6],
-                                measurement="captcha",
-                            ).inc()
-                            return k
+        # a thread can't be cancelled, the client has to give up by itself
+        self._solver = TwoCaptcha(self._api_key, defaultTimeout=timeout)
+        self._timeout = timeout
+        self._image_format = image_format
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # image work runs in processes, the blocking provider client in threads
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._threads = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="2captcha"
+        )
+
+    def _release(self, fut: "asyncio.Future[dict]"):
+        self._semaphore.release()
+        if not fut.cancelled():
+            fut.exception()  # retrieved, nobody may await an abandoned call
+
+    async def solve_image(self, img_bytes: bytes, labels: List[str]) -> str:
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=2)
+        loop = asyncio.get_running_loop()
+        adapted, boxes = await loop.run_in_executor(
+            self._processes, _adapt, img_bytes, labels, self._image_format
+        )
+        await self._semaphore.acquire()
+        fut = loop.run_in_executor(
+            self._threads,
+            partial(
+                self._solver.coordinates,
+                adapted.decode("utf-8"),
+                hintText="Please select which description best fits the image",
+                lang="en",
+            ),
+        )
+        # the slot is busy till the thread ends, even if the caller went away
+        fut.add_done_callback(self._release)
+        try:
+            res = await asyncio.wait_for(asyncio.shield(fut), self._timeout)
+        except asyncio.TimeoutError:
+            SERVICE_ERRORS.labels(
+                service=self.__class__.__name__,
+                error="timeout",
+                account=self._api_key[:-6],
+            ).inc()
+            raise NotFound("captcha solution timed out")
+        if "code" in res and ":" in res["code"]:
+            coords = res["code"].split(":")[1]
+            x, y = coords.split(",")
+            _, x = x.split("=")
+            _, y = y.split("=")
+            for k, v in boxes.items():
+                if (v[0] < int(x) < v[2]) and (v[1] < int(y) < v[3]):
+                    SERVICE_USAGE.labels(
+                        service=self.__class__.__name__,
+                        account=self._api_key[:-6],
+                        measurement="captcha",
+                    ).inc()
+                    return k
         SERVICE_ERRORS.labels(
             service=self.__class__.__name__,
             error="not_solved",
             account=self._api_key[:-6],
         ).inc()
 
-        raise NotFound(f"solution for {img_url} wasn't found {res}")
+        raise NotFound(f"captcha solution wasn't found {res}")
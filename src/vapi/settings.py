@@ -1,3 +1,6 @@
+from datetime import timedelta
+from typing import List
+
 from pydantic import BaseSettings
 
 
@@ -6,3 +9,16 @@ class Settings(BaseSettings):
     discord_identity_file: str = "discord_ids.csv"
     redis_dsn: str
     twocapchas_api_key: str
+    twocapchas_extra_keys: List[str] = []  # more accounts to hedge with
+    pool_stats_ttl: float = 1.0
+    progress_flush_interval: float = 5.0
+    captcha_concurrency: int = 4
+    captcha_timeout: float = 180
+    captcha_image_format: str = "PNG"
+    captcha_cache_ttl: timedelta = timedelta(days=1)
+    captcha_hedge_after: float = 15
+    blob_store_path: str = "blobs"
+    derived_max_bytes: int = 1 << 30  # thumbnails and crops, least recently used go
+    derived_sweep_interval: float = 60  # seconds, the bot process sweeps them
+    thumbnail_sizes: List[int] = [256, 512]
+    thumbnail_format: str = "webp"
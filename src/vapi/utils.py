@@ -1,4 +1,5 @@
 import base64
+from functools import lru_cache
 from io import BytesIO
 from typing import List, Tuple
 
@@ -18,38 +19,81 @@ button_text = (0, 0, 0)
 button_highlight = (255, 255, 255)
 
 
-def img2captcha(
-    img: BytesIO, labels: List[str], save_debug: bool = False
-) -> Tuple[bytes, dict]:
-    image = Image.open(img)
-    image = image.resize((image.width // 6, image.height // 6))
-    # Create a draw object
-    draw = ImageDraw.Draw(image)
-    font = ImageFont.truetype("DejaVuSerif", 8)
+@lru_cache(maxsize=1)
+def _font() -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype("DejaVuSerif", 8)
 
-    # Loop through strings and draw boxes
-    boxes = {}
+
+@lru_cache(maxsize=256)
+def _layout(labels: Tuple[str, ...], height: int) -> List[tuple]:
+    """button rectangle and text origin per label"""
+    font = _font()
+    layout = []
     for i, string in enumerate(labels):
         row = i // num_columns
         col = i % num_columns
         x = padding + col * (box_width + padding)
-        y = image.size[1] - (padding + box_height) * (row + 1)
+        y = height - (padding + box_height) * (row + 1)
 
-        button_rect = (x, y, x + box_width, y + box_height)
-        draw.rectangle(button_rect, fill=button_color, outline=button_outline)
+        _, _, text_w, text_h = font.getbbox(string)
+        text_x = x + (box_width - text_w) // 2
+        text_y = y + (box_height - text_h) // 2
+        layout.append((string, (x, y, x + box_width, y + box_height), (text_x, text_y)))
+    return layout
+
+
+def _open_reduced(img: BytesIO, scale: int) -> Image.Image:
+    image = Image.open(img)
+    size = (max(1, image.width // scale), max(1, image.height // scale))
+    # JPEG decodes at a fraction of the size, anything else is box-reduced
+    image.draft("RGB", size)
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor > 1:
+        # reduce can't average palette indices, bilevel or 16-bit pixels
+        if image.mode in ("1", "P", "PA") or image.mode.startswith("I;16"):
+            transparent = image.mode == "PA" or "transparency" in image.info
+            image = image.convert("RGBA" if transparent else "RGB")
+        image = image.reduce(factor)
+    if image.size != size:
+        image = image.resize(size)
+    return image
 
-        text_size = draw.textsize(string, font=font)
-        text_x = x + (box_width - text_size[0]) // 2
-        text_y = y + (box_height - text_size[1]) // 2
-        draw.text((text_x, text_y), string, font=font, fill=button_text)
 
-        boxes[string] = (x, y, x + box_width, y + box_height)
+def dhash(img: BytesIO, size: int = 8) -> int:
+    """difference hash, stable across rescaling and recompression"""
+    image = Image.open(img)
+    image.draft("L", (size * 4, size * 4))
+    pixels = list(image.convert("L").resize((size + 1, size)).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            value = value << 1 | (left > pixels[row * (size + 1) + col + 1])
+    return value
+
+
+def img2captcha(
+    img: BytesIO, labels: List[str], save_debug: bool = False, fmt: str = "PNG"
+) -> Tuple[bytes, dict]:
+    image = _open_reduced(img, 6)
+    if fmt.upper() == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    # Create a draw object
+    draw = ImageDraw.Draw(image)
+    font = _font()
+
+    # Loop through strings and draw boxes
+    boxes = {}
+    for string, button_rect, text_xy in _layout(tuple(labels), image.size[1]):
+        draw.rectangle(button_rect, fill=button_color, outline=button_outline)
+        draw.text(text_xy, string, font=font, fill=button_text)
+        boxes[string] = button_rect
 
     image_bytes = BytesIO()
-    image.save(image_bytes, format="PNG")
+    image.save(image_bytes, format=fmt)
     result = image_bytes.getvalue()
 
     if save_debug:
-        with open("output.png", "wb") as f:
+        with open("output." + fmt.lower(), "wb") as f:
             f.write(result)
     return base64.b64encode(result), boxes
@@ -1,17 +1,66 @@
+from typing import Any, List
+
 from dependency_injector import containers, providers
 
-from vapi.infrastructure import RedisQueueRepo, TwoCaptchasService
+from vapi.infrastructure import (FileBlobStore, HedgedCaptchaService,
+                                 ImageVariants, InstrumentedQueueService,
+                                 RedisCaptchaCache, RedisQueueRepo,
+                                 TaskWatcher, TwoCaptchasService)
+from vapi.infrastructure.http_base import init_http_session
 from vapi.infrastructure.redis_base import init_redis_pool
 from vapi.settings import Settings
 
 
+def two_captchas_accounts(
+    api_key: str, extra_keys: List[str], **kwargs: Any
+) -> List[TwoCaptchasService]:
+    return [TwoCaptchasService(key, **kwargs) for key in [api_key, *extra_keys]]
+
+
 class Container(containers.DeclarativeContainer):
     wiring_config = containers.WiringConfiguration(packages=["vapi.api"])
 
     settings = providers.Configuration(pydantic_settings=[Settings()])
     redis_conn = providers.Resource(init_redis_pool, settings.redis_dsn)
+    http_session = providers.Resource(init_http_session)
 
-    queue_service = providers.Singleton(RedisQueueRepo, redis=redis_conn)
+    queue_repo = providers.Singleton(
+        RedisQueueRepo, redis=redis_conn, pool_stats_ttl=settings.pool_stats_ttl
+    )
+    queue_service = providers.Singleton(
+        InstrumentedQueueService, queue_service=queue_repo
+    )
+    task_watcher = providers.Singleton(TaskWatcher, queue_service=queue_service)
+    blob_store = providers.Singleton(
+        FileBlobStore,
+        settings.blob_store_path,
+        max_derived_bytes=settings.derived_max_bytes,
+    )
+    image_variants = providers.Singleton(
+        ImageVariants,
+        blob_store=blob_store,
+        sizes=settings.thumbnail_sizes,
+        fmt=settings.thumbnail_format,
+    )
+    captcha_accounts = providers.Singleton(
+        two_captchas_accounts,
+        settings.twocapchas_api_key,
+        settings.twocapchas_extra_keys,
+        session=http_session,
+        max_concurrency=settings.captcha_concurrency,
+        timeout=settings.captcha_timeout,
+        image_format=settings.captcha_image_format,
+    )
+    captcha_solver = providers.Singleton(
+        HedgedCaptchaService,
+        captcha_accounts,
+        hedge_after=settings.captcha_hedge_after,
+        session=http_session,
+    )
     captcha_service = providers.Singleton(
-        TwoCaptchasService, settings.twocapchas_api_key
+        RedisCaptchaCache,
+        redis=redis_conn,
+        captcha_service=captcha_solver,
+        session=http_session,
+        ttl=settings.captcha_cache_ttl,
     )
@@ -0,0 +1,72 @@
+import asyncio
+from io import BytesIO
+from typing import List
+
+import pytest
+from fakeredis import FakeServer, aioredis
+from PIL import Image
+from vapi.application import ICaptchaService
+from vapi.infrastructure import RedisCaptchaCache
+
+labels = ["mashrum", "forest", "monkey"]
+
+
+class CountingCaptchaService(ICaptchaService):
+    """local provider answering the first label"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def solve(self, img_url: str, labels: List[str]) -> str:
+        return await self.solve_image(b"", labels)
+
+    async def solve_image(self, img: bytes, labels: List[str]) -> str:
+        self.calls += 1
+        return labels[0]
+
+
+def challenge() -> bytes:
+    buf = BytesIO()
+    Image.radial_gradient("L").convert("RGB").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def provider() -> CountingCaptchaService:
+    return CountingCaptchaService()
+
+
+@pytest.fixture
+def cache(provider: CountingCaptchaService) -> RedisCaptchaCache:
+    redis = aioredis.FakeRedis(server=FakeServer(), decode_responses=True)
+    return RedisCaptchaCache(redis, provider)
+
+
+@pytest.mark.asyncio
+async def test_repeats_hit_the_cache(
+    cache: RedisCaptchaCache, provider: CountingCaptchaService
+):
+    # the same challenge sent to several bots at once
+    img = challenge()
+    for _ in range(4):
+        assert await cache.solve_image(img, labels) == "mashrum"
+    assert provider.calls == 1
+    await asyncio.gather(*[cache.solve_image(img, labels) for _ in range(4)])
+    assert provider.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_rejected_answer_is_dropped(
+    cache: RedisCaptchaCache, provider: CountingCaptchaService
+):
+    img = challenge()
+    await cache.solve_image(img, labels)
+    await cache.reject_image(img, labels)
+    await cache.solve_image(img, labels)
+    assert provider.calls == 2
+    await cache.solve_image(img, labels)
+    assert provider.calls == 2
+    # another label set is another challenge
+    await cache.reject_image(img, labels[1:])
+    await cache.solve_image(img, labels)
+    assert provider.calls == 2
@@ -0,0 +1,63 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+from vapi.application import ICaptchaService, NotFound
+from vapi.infrastructure import HedgedCaptchaService
+
+labels = ["mashrum", "forest", "monkey"]
+
+
+class FakeCaptchaService(ICaptchaService):
+    """local provider answering after a delay"""
+
+    def __init__(self, delay: float, answer: Optional[str]) -> None:
+        self.delay = delay
+        self.answer = answer
+        self.calls = 0
+        self.cancelled = False
+
+    async def solve(self, img_url: str, labels: List[str]) -> str:
+        return await self.solve_image(b"", labels)
+
+    async def solve_image(self, img: bytes, labels: List[str]) -> str:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.answer is None:
+            raise NotFound("not solved")
+        return self.answer
+
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged():
+    primary = FakeCaptchaService(0.01, "forest")
+    backup = FakeCaptchaService(0.01, "monkey")
+    srv = HedgedCaptchaService([primary, backup], hedge_after=0.1)
+    assert await srv.solve_image(b"", labels) == "forest"
+    assert backup.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled():
+    primary = FakeCaptchaService(1, "forest")
+    backup = FakeCaptchaService(0.01, "monkey")
+    srv = HedgedCaptchaService([primary, backup], hedge_after=0.05)
+    assert await srv.solve_image(b"", labels) == "monkey"
+    await asyncio.sleep(0)
+    assert primary.cancelled
+
+
+@pytest.mark.asyncio
+async def test_failure_hedges_immediately():
+    primary = FakeCaptchaService(0.01, None)
+    invalid = FakeCaptchaService(0.01, "city")
+    backup = FakeCaptchaService(0.01, "cat")
+    srv = HedgedCaptchaService([primary, invalid, backup], hedge_after=10)
+    with pytest.raises(NotFound):
+        await asyncio.wait_for(srv.solve_image(b"", labels), 1)
+    backup.answer = "mashrum"
+    assert await asyncio.wait_for(srv.solve_image(b"", labels), 1) == "mashrum"
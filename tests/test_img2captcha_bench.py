@@ -0,0 +1,77 @@
+import base64
+import time
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from vapi.utils import img2captcha
+
+labels = ["mashrum", "forest", "monkey", "city", "cat"]
+
+
+def img2captcha_old(img: BytesIO, labels):
+    # the previous path: full decode, resize, font load and PNG per call
+    image = Image.open(img)
+    image = image.resize((image.width // 6, image.height // 6))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.truetype("DejaVuSerif", 8)
+    boxes = {}
+    for i, string in enumerate(labels):
+        x = 6 + i % 3 * 56
+        y = image.size[1] - 21 * (i // 3 + 1)
+        draw.rectangle((x, y, x + 50, y + 15), fill=(220, 220, 220))
+        _, _, w, h = font.getbbox(string)
+        draw.text((x + (50 - w) // 2, y + (15 - h) // 2), string, font=font)
+        boxes[string] = (x, y, x + 50, y + 15)
+    image_bytes = BytesIO()
+    image.save(image_bytes, format="PNG")
+    return base64.b64encode(image_bytes.getvalue()), boxes
+
+
+def sample(fmt: str) -> bytes:
+    image = Image.radial_gradient("L").resize((2048, 2048)).convert("RGB")
+    buf = BytesIO()
+    image.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def test_img2captcha():
+    data, boxes = img2captcha(BytesIO(sample("PNG")), labels)
+    image = Image.open(BytesIO(base64.b64decode(data)))
+    assert image.size == (2048 // 6, 2048 // 6)
+    assert list(boxes) == labels
+    assert boxes == img2captcha_old(BytesIO(sample("PNG")), labels)[1]
+    data, _ = img2captcha(BytesIO(sample("JPEG")), labels, fmt="JPEG")
+    assert Image.open(BytesIO(base64.b64decode(data))).format == "JPEG"
+
+
+@pytest.mark.parametrize("mode", ["P", "1", "I;16"])
+def test_img2captcha_modes(mode: str):
+    # reduce() rejects these modes, they're converted first
+    image = Image.radial_gradient("L").resize((1200, 1200)).convert(mode)
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    data, _ = img2captcha(BytesIO(buf.getvalue()), labels)
+    assert Image.open(BytesIO(base64.b64decode(data))).size == (200, 200)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize(
+    "src,fmt", [("PNG", "PNG"), ("JPEG", "PNG"), ("WEBP", "PNG"), ("PNG", "JPEG")]
+)
+def test_bench_img2captcha(src: str, fmt: str):
+    raw = sample(src)
+    rounds = 5
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        _, old_boxes = img2captcha_old(BytesIO(raw), labels)
+    old = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        _, boxes = img2captcha(BytesIO(raw), labels, fmt=fmt)
+    new = (time.perf_counter() - start) / rounds
+
+    print(f"\n{src}->{fmt}: old {old * 1e3:.1f}ms, new {new * 1e3:.1f}ms")
+    assert boxes == old_boxes
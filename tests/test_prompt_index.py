@@ -0,0 +1,71 @@
+import re
+import time
+import uuid
+
+import pytest
+from vapi.infrastructure.service.prompt_index import PromptIndex
+
+clean_str = re.compile(r"[^A-Za-z]")
+re_url = re.compile(r"http(s)?://[^\s]+")
+percent_re = r"\d+%"
+
+words = ["armor", "forest", "monkey", "city", "cat", "neon", "castle", "ocean"]
+
+
+def str_in_str(substr: str, string: str) -> bool:
+    # per-comparison normalization used before the index
+    return clean_str.sub(
+        "", re.split(percent_re, re_url.sub("", substr))[0].split("--")[0]
+    ) in clean_str.sub(
+        "", re.split(percent_re, re_url.sub("", string))[0].split("--")[0]
+    )
+
+
+def prompts(n: int):
+    return {
+        # digits are dropped by normalization, so spell the index out in letters
+        uuid.uuid4(): f"{words[i % 8]} {words[i // 8 % 8]} "
+        + "".join(chr(97 + int(d)) for d in str(i))
+        + " style"
+        for i in range(n)
+    }
+
+
+def test_match():
+    index = PromptIndex()
+    short, long = uuid.uuid4(), uuid.uuid4()
+    index.add(long, "Minotaur in iron armor, one horn, red background")
+    index.add(short, "Minotaur in iron armor")
+    msg = (
+        "**Minotaur in iron armor, one horn, red background --v 5** - <@1> (0%) (fast)"
+    )
+    assert index.match(msg) == short
+    index.discard(short)
+    assert index.match(msg) == long
+    assert index.match("something else", msg) == long
+    assert index.match("something else", None) is None
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n", [10, 100, 1000])
+def test_bench_match(n: int):
+    tasks = prompts(n)
+    index = PromptIndex()
+    for uid, prompt in tasks.items():
+        index.add(uid, prompt)
+    target = list(tasks)[n // 2]
+    msg = f"**{tasks[target]} --v 5** - <@1096470137110020137> (Waiting to start)"
+    rounds = 20
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        found = [uid for uid, p in tasks.items() if str_in_str(p, msg)]
+    scan = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        uid = index.match(msg)
+    indexed = (time.perf_counter() - start) / rounds
+
+    print(f"\n{n} tasks: scan {scan * 1e6:.1f}us, index {indexed * 1e6:.1f}us")
+    assert found == [target] and uid == target
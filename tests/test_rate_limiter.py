@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import pytest
+from vapi.infrastructure.service import rate_limiter
+from vapi.infrastructure.service.rate_limiter import DiscordRateLimiter
+
+route = "https://discord.com/api/v9/interactions"
+
+
+class FakeClock:
+    """time.monotonic and asyncio.sleep of the limiter, moved by the test"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self._sleepers: List[Tuple[float, "asyncio.Future[None]"]] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        fut = asyncio.get_running_loop().create_future()
+        self._sleepers.append((self.now + delay, fut))
+        await fut
+
+    async def advance(self, delta: float):
+        self.now += delta
+        for item in list(self._sleepers):
+            if item[0] <= self.now:
+                self._sleepers.remove(item)
+                item[1].set_result(None)
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def waited(self, acquire: "asyncio.Task[None]", step: float = 0.5) -> float:
+        start = self.now
+        await self.advance(0)
+        while not acquire.done():
+            await self.advance(step)
+        return self.now - start
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    monkeypatch.setattr(
+        rate_limiter, "asyncio", SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep)
+    )
+    return clock
+
+
+@pytest.mark.asyncio
+async def test_exhausted_bucket_waits_for_reset(clock: FakeClock):
+    limiter = DiscordRateLimiter("bot")
+    limiter.update(
+        route, 200, {"X-RateLimit-Remaining": "1", "X-RateLimit-Reset-After": "2"}
+    )
+    assert await clock.waited(asyncio.create_task(limiter.acquire(route))) == 0
+    assert await clock.waited(asyncio.create_task(limiter.acquire(route))) == 2
+    # the bucket is refilled after the reset
+    assert await clock.waited(asyncio.create_task(limiter.acquire(route))) == 0
+
+
+@pytest.mark.asyncio
+async def test_global_429_blocks_every_route(clock: FakeClock):
+    limiter = DiscordRateLimiter("bot")
+    limiter.update("other", 429, {"Retry-After": "1.5"})
+    assert await clock.waited(asyncio.create_task(limiter.acquire(route))) == 0
+    assert await clock.waited(asyncio.create_task(limiter.acquire("other"))) == 1.5
+    limiter.update(route, 429, {"Retry-After": "3", "X-RateLimit-Global": "true"})
+    assert await clock.waited(asyncio.create_task(limiter.acquire("other"))) == 3
+
+
+@pytest.mark.asyncio
+async def test_bucket_change_while_queued(clock: FakeClock):
+    limiter = DiscordRateLimiter("bot")
+    exhausted = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": "1"}
+    # a new bucket id keeps the bucket, its queue goes on waiting there
+    limiter.update(route, 200, exhausted)
+    queued = asyncio.create_task(limiter.acquire(route))
+    await clock.advance(0)
+    limiter.update(
+        route,
+        200,
+        {**exhausted, "X-RateLimit-Bucket": "b1", "X-RateLimit-Reset-After": "2"},
+    )
+    assert await clock.waited(queued) == 2
+
+    # the route turns out to share a bucket known from another route
+    limiter = DiscordRateLimiter("bot")
+    shared = {**exhausted, "X-RateLimit-Bucket": "b2", "X-RateLimit-Reset-After": "4"}
+    limiter.update("other", 200, shared)
+    limiter.update(route, 200, exhausted)
+    queued = asyncio.create_task(limiter.acquire(route))
+    await clock.advance(0)
+    limiter.update(route, 200, shared)
+    assert await clock.waited(queued) == 4
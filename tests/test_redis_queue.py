@@ -0,0 +1,215 @@
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+import pytest
+from fakeredis import FakeServer, aioredis
+from vapi.application import (Command, GenerateTask, Outcome, Priority,
+                              RouteLabel, Task, TaskDeliverable)
+from vapi.infrastructure import RedisQueueRepo
+
+pool = "common"
+bot_id = 5
+visibility = timedelta(minutes=1)
+
+
+@pytest.fixture
+def repo() -> RedisQueueRepo:
+    # scripts run on lupa, fakeredis' Lua runtime
+    redis = aioredis.FakeRedis(server=FakeServer(), decode_responses=True)
+    return RedisQueueRepo(redis, pool_stats_ttl=0)
+
+
+def new_task(priority: Priority = Priority.Low, **kwargs) -> Task:
+    return Task(
+        route_label=RouteLabel(priority=priority, bot_pool=pool),
+        command=Command.New,
+        params=GenerateTask(prompt="cat"),
+        **kwargs,
+    )
+
+
+def labels():
+    return [RouteLabel(priority=p, bot_pool=pool) for p in Priority]
+
+
+@pytest.mark.asyncio
+async def test_create_rejects_taken_uuid(repo: RedisQueueRepo):
+    task = new_task()
+    assert await repo.create_and_publish_many([task, new_task()]) == [True, True]
+    assert not await repo.create_and_publish(task)
+    assert await repo.get_queue_len(task.route_label) == 2
+    assert (await repo.get_task_by_id(task.uuid)).params.prompt == "cat"
+
+
+@pytest.mark.asyncio
+async def test_pop_leases_in_priority_order(repo: RedisQueueRepo):
+    low, high = new_task(), new_task(Priority.High)
+    await repo.create_and_publish_many([low, high])
+    dequeued = await repo.get_first_task_id(labels(), bot_id, visibility)
+    assert dequeued.task_id == high.uuid
+    assert dequeued.route_label.priority == Priority.High
+    assert dequeued.queue_lens == [0, 0, 0, 1]
+    zset, owner = repo._get_inflight_names(pool)
+    assert await repo._redis.hget(owner, str(high.uuid)) == str(bot_id)
+    assert await repo._redis.zscore(zset, str(high.uuid)) > time.time()
+    assert (await repo.get_first_task_id(labels())).task_id == low.uuid
+    assert await repo.get_first_task_id(labels()) is None
+
+
+@pytest.mark.asyncio
+async def test_wait_wakes_on_push(repo: RedisQueueRepo):
+    start = time.monotonic()
+    assert await repo.wait_first_task_id(labels(), 1) is None
+    assert time.monotonic() - start >= 1
+    task = new_task()
+
+    async def create():
+        await asyncio.sleep(0.1)
+        await repo.create_and_publish(task)
+
+    asyncio.create_task(create())
+    start = time.monotonic()
+    dequeued = await repo.wait_first_task_id(labels(), 5, bot_id, visibility)
+    assert dequeued.task_id == task.uuid
+    assert time.monotonic() - start < 1
+    _, owner = repo._get_inflight_names(pool)
+    assert await repo._redis.hget(owner, str(task.uuid)) == str(bot_id)
+
+
+@pytest.mark.asyncio
+async def test_push_wakes_only_bots_of_that_queue(repo: RedisQueueRepo):
+    # a fast mode bot skips the shared Normal/Low queues
+    fast = [RouteLabel(priority=p, bot_pool=pool) for p in Priority][:2]
+    task = new_task(Priority.Low)
+
+    async def create():
+        await asyncio.sleep(0.1)
+        await repo.create_and_publish(task)
+
+    skipping = asyncio.create_task(repo.wait_first_task_id(fast, 3, bot_id + 1))
+    asyncio.create_task(create())
+    start = time.monotonic()
+    dequeued = await repo.wait_first_task_id(labels(), 3, bot_id, visibility)
+    assert dequeued.task_id == task.uuid
+    assert time.monotonic() - start < 1
+    skipping.cancel()
+
+
+@pytest.mark.asyncio
+async def test_release_only_by_owner(repo: RedisQueueRepo):
+    task = new_task()
+    await repo.create_and_publish(task)
+    await repo.get_first_task_id(labels(), bot_id, visibility)
+    assert not await repo.release_task(task.uuid, pool, bot_id + 1)
+    assert await repo.release_task(task.uuid, pool, bot_id)
+    assert not await repo.release_task(task.uuid, pool, bot_id)
+    zset, owner = repo._get_inflight_names(pool)
+    assert await repo._redis.zcard(zset) == 0
+    assert await repo._redis.hlen(owner) == 0
+
+
+@pytest.mark.asyncio
+async def test_reap(repo: RedisQueueRepo):
+    new, pending, done, mine = new_task(), new_task(), new_task(), new_task()
+    await repo.create_and_publish_many([new, pending, done, mine])
+    for _ in range(3):
+        await repo.get_first_task_id(labels(), bot_id, timedelta(seconds=-1))
+    await repo.get_first_task_id(labels(), bot_id, visibility)
+    await repo.update_task_fields(pending.uuid, status=Outcome.Pending)
+    await repo.update_task_fields(done.uuid, status=Outcome.Success)
+
+    reaped = await repo.reap_tasks(pool)
+    assert {t.uuid for t in reaped} == {new.uuid, pending.uuid}
+    failed = await repo.get_task_by_id(pending.uuid)
+    assert failed.status == Outcome.Failure and failed.completed_at is not None
+    assert (await repo.get_first_task_id(labels())).task_id == new.uuid
+    # a restarted bot takes back what it leased but never sent
+    assert await repo.reap_tasks(pool) == []
+    assert [t.uuid for t in await repo.reap_tasks(pool, bot_id)] == [mine.uuid]
+    assert (await repo.get_first_task_id(labels())).task_id == mine.uuid
+
+
+@pytest.mark.asyncio
+async def test_reap_keeps_success_written_meanwhile(repo: RedisQueueRepo):
+    task = new_task()
+    await repo.create_and_publish(task)
+    await repo.get_first_task_id(labels(), bot_id, timedelta(seconds=-1))
+    await repo.update_task_fields(task.uuid, status=Outcome.Pending)
+    get_hashes = repo._get_hashes
+
+    async def finish_after_read(keys):
+        # the owning bot completes the task while the reaper looks at it
+        c = await get_hashes(keys)
+        await repo.update_task_fields(
+            task.uuid,
+            status=Outcome.Success,
+            deliverable=TaskDeliverable(url="http://x/1.png", filename="1.png"),
+        )
+        return c
+
+    repo._get_hashes = finish_after_read
+    assert await repo.reap_tasks(pool) == []
+    stored = await repo.get_task_by_id(task.uuid)
+    assert stored.status == Outcome.Success
+    assert stored.deliverable.filename == "1.png"
+    assert stored.completed_at is None
+
+
+@pytest.mark.asyncio
+async def test_pool_stats(repo: RedisQueueRepo):
+    await repo.create_and_publish_many([new_task(), new_task(), new_task(Priority.VIP)])
+    await repo.put_ticket(
+        RouteLabel(priority=Priority.Normal, bot_pool=pool, bot_id=bot_id)
+    )
+    key = repo._get_tickets_name(RouteLabel(priority=Priority.Normal, bot_pool=pool))
+    await repo._redis.zadd(key, {bot_id + 1: time.time() - 1})
+    stats = await repo.get_pool_stats(pool)
+    assert stats.queue_len == {
+        Priority.VIP: 1,
+        Priority.High: 0,
+        Priority.Normal: 0,
+        Priority.Low: 2,
+    }
+    assert stats.tickets[Priority.Normal] == 1
+    assert stats.tickets[Priority.High] == 0
+
+
+@pytest.mark.asyncio
+async def test_update_fields_publishes(repo: RedisQueueRepo):
+    task = new_task()
+    assert not await repo.update_task_fields(task.uuid, progress=10)
+    await repo.create_and_publish(task)
+    pubsub = repo._redis.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(repo.task_events)
+    assert await repo.update_task_fields(task.uuid, progress=10, discord_msg_id=7)
+    message = await pubsub.get_message(timeout=1)
+    while message is None:
+        message = await pubsub.get_message(timeout=1)
+    published = RedisQueueRepo._hash2task(json.loads(message["data"]))
+    assert published.progress == 10 and published.discord_msg_id == 7
+    stored = await repo.get_task_by_id(task.uuid)
+    assert stored.progress == 10 and stored.params.prompt == "cat"
+    with pytest.raises(ValueError):
+        await repo.update_task_fields(task.uuid, uuid=task.uuid)
+    await pubsub.close()
+
+
+@pytest.mark.asyncio
+async def test_legacy_json_tasks_are_upgraded(repo: RedisQueueRepo):
+    # tasks were json strings before they became hashes
+    old, leased = new_task(), new_task()
+    for task in (old, leased):
+        await repo._redis.set(str(task.uuid), task.json(), ex=60)
+    assert (await repo.get_task_by_id(old.uuid)).params.prompt == "cat"
+    assert await repo._redis.type(str(old.uuid)) == "hash"
+    assert await repo._redis.ttl(str(old.uuid)) <= 60
+
+    await repo.push_back_task_id(str(leased.uuid), leased.route_label)
+    await repo.get_first_task_id(labels(), bot_id, visibility)
+    assert [t.uuid for t in await repo.reap_tasks(pool, bot_id)] == [leased.uuid]
+    await repo._redis.set(str(leased.uuid), leased.json(), ex=60)
+    assert await repo.update_task_fields(leased.uuid, progress=10)
+    found = await repo.get_tasks_by_ids([old.uuid, leased.uuid])
+    assert found[leased.uuid].progress == 10